@@ -1,6 +1,11 @@
+import sys
 import socket
 import os
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from pose_packet import is_pose_packet, decode_pose_packet
+
 # Create a UDP socket
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
@@ -10,4 +15,7 @@ sock.bind(('localhost', 10000))
 while True:
     data, addr = sock.recvfrom(4096)  # buffer size is 1024 bytes
     os.system('cls' if os.name == 'nt' else "printf '\033c'")
-    print('received {}'.format(data.decode()))
+    if is_pose_packet(data):
+        print('received {}'.format(decode_pose_packet(data)))
+    else:
+        print('received {}'.format(data.decode()))
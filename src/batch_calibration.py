@@ -0,0 +1,191 @@
+import argparse
+import collections
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+from calibration_registry import calibration_registry
+from replay import ReplaySource
+from video_source_calibration import CHESSBOARD_SIZE, VideoSourceCalibrationConfig, calibrate_camera, \
+    find_chessboard_corners
+
+BASE_VIDEO_SOURCE_DIR = '../assets/camera_calibration_data'
+# Frames whose board is less sharp than this fraction of the median board are not used.
+MIN_RELATIVE_SHARPNESS = 0.5
+# Cells of the grid the coverage of the image by the selected boards is reported on.
+COVERAGE_GRID = (4, 4)
+
+BoardView = collections.namedtuple('BoardView', ['sequence', 'corners', 'sharpness'])
+
+
+def board_view(sequence, gray):
+    # Runs in the pool. The sharpness is the variance of the laplacian inside the board.
+    corners = find_chessboard_corners(gray)
+    if corners is None:
+        return None
+
+    x, y, width, height = cv2.boundingRect(corners)
+    sharpness = cv2.Laplacian(gray[y:y + height, x:x + width], cv2.CV_64F).var()
+
+    return BoardView(sequence, corners, float(sharpness))
+
+
+def find_board_views(source, step, workers):
+    # Every step-th frame is searched, with a bounded number of frames waiting in the pool.
+    board_views = []
+    frames = 0
+    image_size = None
+    pending_views = collections.deque()
+    with ProcessPoolExecutor(workers) as pool:
+        try:
+            while True:
+                captured_frame = source.read()
+                if captured_frame is None:
+                    break
+
+                frames += 1
+                if captured_frame.sequence % step != 0:
+                    continue
+
+                gray = cv2.cvtColor(captured_frame.image, cv2.COLOR_BGR2GRAY)
+                image_size = gray.shape[::-1]
+                pending_views.append(pool.submit(board_view, captured_frame.sequence, gray))
+
+                while len(pending_views) > 2 * workers:
+                    board_views.append(pending_views.popleft().result())
+        finally:
+            source.release()
+
+        board_views.extend(future.result() for future in pending_views)
+
+    return [view for view in board_views if view is not None], frames, image_size
+
+
+def view_features(board_view, image_size):
+    # Where the board is, how large and how tilted, the selected views should differ in all of them.
+    columns, rows = CHESSBOARD_SIZE
+    corners = board_view.corners.reshape(rows, columns, 2)
+    width, height = image_size
+
+    center_x, center_y = corners.reshape(-1, 2).mean(axis=0) / [width, height]
+    area = cv2.contourArea(np.array([corners[0, 0], corners[0, -1], corners[-1, -1], corners[-1, 0]],
+                                    dtype=np.float32))
+    size = np.sqrt(area / (width * height))
+
+    # Perspective makes the near edge of a tilted board longer than the far one. The board may be
+    # found in either direction, so only the amount of tilt is kept.
+    top, bottom = np.linalg.norm(corners[0, -1] - corners[0, 0]), np.linalg.norm(corners[-1, -1] - corners[-1, 0])
+    left, right = np.linalg.norm(corners[-1, 0] - corners[0, 0]), np.linalg.norm(corners[-1, -1] - corners[0, -1])
+    tilt_x = abs(np.log(left / right))
+    tilt_y = abs(np.log(top / bottom))
+
+    return np.array([center_x, center_y, size, tilt_x, tilt_y])
+
+
+def select_views(board_views, image_size, count):
+    # Blurry views are dropped, then the sharpest view is taken and each next view is the one
+    # farthest from every view already taken.
+    if len(board_views) == 0:
+        return []
+
+    median_sharpness = np.median([view.sharpness for view in board_views])
+    board_views = [view for view in board_views if view.sharpness >= MIN_RELATIVE_SHARPNESS * median_sharpness]
+    features = np.array([view_features(view, image_size) for view in board_views])
+
+    selected = [int(np.argmax([view.sharpness for view in board_views]))]
+    distances = np.linalg.norm(features - features[selected[0]], axis=1)
+    while len(selected) < min(count, len(board_views)):
+        farthest = int(np.argmax(distances))
+        selected.append(farthest)
+        distances = np.minimum(distances, np.linalg.norm(features - features[farthest], axis=1))
+
+    return [board_views[index] for index in selected]
+
+
+def coverage(board_views, image_size):
+    columns, rows = COVERAGE_GRID
+    width, height = image_size
+    covered = np.zeros((rows, columns), dtype=bool)
+    for view in board_views:
+        points = view.corners.reshape(-1, 2)
+        cells_x = np.clip((points[:, 0] / width * columns).astype(int), 0, columns - 1)
+        cells_y = np.clip((points[:, 1] / height * rows).astype(int), 0, rows - 1)
+        covered[cells_y, cells_x] = True
+
+    return covered.mean()
+
+
+def calibrate_source(source_path, device_parameters_dir, chessboard_square_size, views, step, workers, fps):
+    board_views, frames, image_size = find_board_views(ReplaySource(source_path, fps), step, workers)
+    if image_size is None:
+        print("{}: no frames".format(source_path))
+        return False
+
+    selected_views = select_views(board_views, image_size, views)
+
+    print("{}: {} frames, board found in {}, {} views selected, {:.0%} of the image covered".format(
+        source_path, frames, len(board_views), len(selected_views), coverage(selected_views, image_size)))
+    if len(selected_views) < 10:
+        print("{}: not enough views of the board to calibrate".format(source_path))
+        return False
+
+    rms_error, cam_mtx, dist = calibrate_camera(
+        [view.corners for view in selected_views], image_size, chessboard_square_size)
+    calibration_registry.save(device_parameters_dir, cam_mtx, dist, image_size)
+
+    print("{}: reprojection error {:.3f} px, saved to {}".format(source_path, rms_error, device_parameters_dir))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibrates cameras from recordings of the 9x6 chessboard, without the interface.")
+    parser.add_argument('sources', nargs='+', help="video files or directories of images, one per camera")
+    parser.add_argument('--device-parameters-dir',
+                        help="calibration directory of a single source, by default each source is saved "
+                             "under {} in a directory named after it".format(BASE_VIDEO_SOURCE_DIR))
+    parser.add_argument('--square-size', type=float,
+                        help="chessboard square size, the calibration config one by default")
+    parser.add_argument('--views', type=int, default=50,
+                        help="views of the board used to calibrate")
+    parser.add_argument('--step', type=int, default=5,
+                        help="only every step-th frame is searched for the board")
+    parser.add_argument('--fps', type=float, default=30.0,
+                        help="frame rate of image directories and of videos without one")
+    parser.add_argument('--workers', type=int, default=max(multiprocessing.cpu_count() - 1, 1))
+    args = parser.parse_args()
+
+    if args.device_parameters_dir is not None and len(args.sources) > 1:
+        parser.error("--device-parameters-dir takes a single source")
+
+    chessboard_square_size = args.square_size
+    if chessboard_square_size is None:
+        chessboard_square_size = VideoSourceCalibrationConfig.persisted().chessboard_square_size
+    if chessboard_square_size == "":
+        parser.error("No chessboard square size saved, pass --square-size")
+
+    failed = 0
+    for source_path in args.sources:
+        device_parameters_dir = args.device_parameters_dir
+        if device_parameters_dir is None:
+            name = os.path.splitext(os.path.basename(os.path.normpath(source_path)))[0]
+            device_parameters_dir = '{}/{}'.format(BASE_VIDEO_SOURCE_DIR, name.replace(" ", "_"))
+
+        # A source that can not be read or calibrated does not stop the other cameras.
+        try:
+            calibrated = calibrate_source(source_path, device_parameters_dir, chessboard_square_size,
+                                          args.views, args.step, args.workers, args.fps)
+        except Exception as error:  # pylint: disable=broad-except
+            print("{}: {}".format(source_path, error))
+            calibrated = False
+
+        if not calibrated:
+            failed += 1
+
+    if failed > 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
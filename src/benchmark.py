@@ -0,0 +1,389 @@
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import cv2
+import cv2.aruco as aruco
+from frame_grabber import CapturedFrame
+from marker_detection_settings import SingleMarkerDetectionSettings, MarkersCubeDetectionSettings, \
+    MultiTargetDetectionSettings
+from calibration_registry import calibration_registry
+from tracking import Tracking
+import geometry
+
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080), '4K': (3840, 2160)}
+MARKERS_LENGTH = 5.0
+# Scene depth, the same scene is rendered at every resolution.
+SCENE_DEPTH = 60.0
+# Cube faces are larger than their markers, which keeps a white margin around them.
+CUBE_SIDE = 1.6 * MARKERS_LENGTH
+# Marker cells, borders included, and the white quiet zone cells around them. A thinner
+# quiet zone on a gray background is not detected.
+MARKER_CELLS = 8
+QUIET_ZONE_CELLS = 2
+TEXTURE_CELL_PIXELS = 16
+
+
+def camera_matrix(resolution):
+    width, height = resolution
+
+    return np.array([[0.9 * width, 0, width / 2],
+                     [0, 0.9 * width, height / 2],
+                     [0, 0, 1]])
+
+
+def marker_texture(dictionary, marker_id):
+    marker_pixels = MARKER_CELLS * TEXTURE_CELL_PIXELS
+    quiet_zone_pixels = QUIET_ZONE_CELLS * TEXTURE_CELL_PIXELS
+
+    marker = aruco.drawMarker(dictionary, marker_id, marker_pixels)
+
+    return cv2.copyMakeBorder(cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR),
+                              quiet_zone_pixels, quiet_zone_pixels, quiet_zone_pixels, quiet_zone_pixels,
+                              cv2.BORDER_CONSTANT, value=(255, 255, 255))
+
+
+def marker_face_poses():
+    # Pose of each cube face marker in the cube frame, the cube frame is the up marker one.
+    half_side = CUBE_SIDE / 2
+    faces = []
+    for side in range(0, 4):
+        angle = side * np.pi / 2
+        normal = np.array([np.cos(angle), np.sin(angle), 0.0])
+        tangent = np.array([-np.sin(angle), np.cos(angle), 0.0])
+
+        face = np.eye(4)
+        face[:3, 0] = tangent
+        face[:3, 1] = [0, 0, 1]
+        face[:3, 2] = normal
+        face[:3, 3] = normal * half_side + [0, 0, -half_side]
+        faces.append(face)
+
+    down_face = np.eye(4)
+    down_face[:3, :3] = np.diag([1.0, -1.0, -1.0])
+    down_face[:3, 3] = [0, 0, -CUBE_SIDE]
+
+    return faces, down_face
+
+
+class SyntheticTarget:
+
+    def __init__(self, name, settings, markers, base_pose, phase):
+        self.name = name
+        self.settings = settings
+        # (marker id, pose of the marker in the target frame)
+        self.markers = markers
+        self.__base_pose = base_pose
+        self.__phase = phase
+
+    def pose(self, frame_index):
+        # Slow drift and wobble around the base pose, so the filter and the ROI search see motion.
+        angle = 2 * np.pi * frame_index / 90 + self.__phase
+
+        pose = self.__base_pose.copy()
+        pose[:3, :3] = np.dot(self.__base_pose[:3, :3], geometry.euler_to_rotation_matrices(
+            [0.15 * np.sin(angle), 0.15 * np.cos(angle), 0.1 * np.sin(angle)])[0])
+        pose[:3, 3] += [2.0 * np.sin(angle), 1.0 * np.cos(angle), 3.0 * np.sin(angle)]
+
+        return pose
+
+
+def single_marker_targets(count):
+    columns = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / columns))
+
+    targets = []
+    for index in range(0, count):
+        row, column = divmod(index, columns)
+        base_pose = np.eye(4)
+        # Markers face the camera, tilted differently.
+        base_pose[:3, :3] = geometry.euler_to_rotation_matrices(
+            [np.pi + 0.3 * np.sin(index), 0.3 * np.cos(index), 0.5 * index])[0]
+        # Larger grids are moved away from the camera, so every marker stays in the frame.
+        base_pose[:3, 3] = [(column - (columns - 1) / 2) * 14.0,
+                            (row - (rows - 1) / 2) * 10.0,
+                            SCENE_DEPTH * max(1.0, columns / 2)]
+
+        settings = SingleMarkerDetectionSettings(MARKERS_LENGTH, index)
+        targets.append(SyntheticTarget("marker_{}".format(index), settings,
+                                       [(index, np.eye(4))], base_pose, index))
+
+    return targets
+
+
+def cube_targets(count):
+    side_faces, down_face = marker_face_poses()
+
+    targets = []
+    for index in range(0, count):
+        first_id = 100 + index * 6
+        side_ids = list(range(first_id + 1, first_id + 5))
+        down_id = first_id + 5
+
+        markers = [(first_id, np.eye(4))] + list(zip(side_ids, side_faces)) + [(down_id, down_face)]
+        transformations = {marker_id: geometry.rigid_inverse(face)[0]
+                           for marker_id, face in markers[1:]}
+
+        base_pose = np.eye(4)
+        # Seen from above and from a side, so two or three faces are visible.
+        base_pose[:3, :3] = geometry.euler_to_rotation_matrices(
+            [np.pi - 0.8, 0.0, 0.6 + index])[0]
+        base_pose[:3, 3] = [(index - (count - 1) / 2) * 22.0, 0.0, SCENE_DEPTH]
+
+        settings = MarkersCubeDetectionSettings(
+            MARKERS_LENGTH, first_id, side_ids, down_id, transformations)
+        targets.append(SyntheticTarget("cube_{}".format(index), settings,
+                                       markers, base_pose, index))
+
+    return targets
+
+
+class SyntheticScene:
+
+    def __init__(self, targets, resolution, noise, blur):
+        self.targets = targets
+        self.resolution = resolution
+        self.cam_mtx = camera_matrix(resolution)
+        self.dist = np.zeros(5)
+        self.__noise = noise
+        self.__blur = blur
+
+        dictionary = aruco.Dictionary_get(aruco.DICT_6X6_250)
+        self.__textures = {}
+        for target in targets:
+            for marker_id, _ in target.markers:
+                self.__textures[marker_id] = marker_texture(dictionary, marker_id)
+
+        width, height = resolution
+        # Smooth uneven lighting, so thresholding is not trivial.
+        gradient = np.linspace(150, 210, width)[None, :] + np.linspace(-15, 15, height)[:, None]
+        self.__background = np.repeat(gradient[:, :, None], 3, axis=2).astype(np.uint8)
+
+    @property
+    def detection_settings(self):
+        if len(self.targets) == 1:
+            return self.targets[0].settings
+
+        return MultiTargetDetectionSettings([(target.name, target.settings) for target in self.targets])
+
+    def render(self, frame_index):
+        # Returns the frame and the ground truth pose of each target.
+        frame = self.__background.copy()
+        poses = [target.pose(frame_index) for target in self.targets]
+
+        # Markers facing the camera only, farthest first.
+        visible_markers = []
+        for target, pose in zip(self.targets, poses):
+            for marker_id, marker_pose in target.markers:
+                camera_marker_pose = np.dot(pose, marker_pose)
+                normal = camera_marker_pose[:3, 2]
+                position = camera_marker_pose[:3, 3]
+                if np.dot(normal, position) < 0:
+                    visible_markers.append((position[2], marker_id, camera_marker_pose))
+
+        for _, marker_id, camera_marker_pose in sorted(visible_markers, key=lambda marker: -marker[0]):
+            self.__draw_marker(frame, self.__textures[marker_id], camera_marker_pose)
+
+        if self.__blur > 0:
+            frame = cv2.GaussianBlur(frame, (0, 0), self.__blur)
+
+        if self.__noise > 0:
+            noise = np.empty(frame.shape, dtype=np.int16)
+            cv2.randn(noise, 0, self.__noise)
+            frame = cv2.add(frame, noise, dtype=cv2.CV_8U)
+
+        return frame, poses
+
+    def __draw_marker(self, frame, texture, camera_marker_pose):
+        half_length = MARKERS_LENGTH / 2 * (MARKER_CELLS + 2 * QUIET_ZONE_CELLS) / MARKER_CELLS
+        # Same corner order as the aruco detection: top left, top right, bottom right, bottom left.
+        object_points = np.array([[-half_length, half_length, 0], [half_length, half_length, 0],
+                                  [half_length, -half_length, 0], [-half_length, -half_length, 0]])
+
+        rvec = geometry.rotation_matrices_to_rodrigues(camera_marker_pose[:3, :3])[0]
+        image_points, _ = cv2.projectPoints(
+            object_points, rvec, camera_marker_pose[:3, 3], self.cam_mtx, self.dist)
+        image_points = image_points.reshape(4, 2)
+
+        # Only the bounding box of the marker is warped.
+        height, width = frame.shape[:2]
+        x_min, y_min = np.maximum(np.floor(image_points.min(axis=0)).astype(int), 0)
+        x_max, y_max = np.minimum(np.ceil(image_points.max(axis=0)).astype(int) + 1, [width, height])
+        if x_min >= x_max or y_min >= y_max:
+            return
+
+        size = texture.shape[0] - 1
+        texture_points = np.array([[0, 0], [size, 0], [size, size], [0, size]], dtype=np.float32)
+        homography = cv2.getPerspectiveTransform(
+            texture_points, (image_points - [x_min, y_min]).astype(np.float32))
+
+        cv2.warpPerspective(texture, homography, (int(x_max - x_min), int(y_max - y_min)),
+                            dst=frame[y_min:y_max, x_min:x_max], flags=cv2.INTER_LINEAR,
+                            borderMode=cv2.BORDER_TRANSPARENT)
+
+
+def pose_errors(estimated_pose, true_pose):
+    translation_error = np.linalg.norm(estimated_pose[:3, 3] - true_pose[:3, 3])
+
+    relative_rotation = np.dot(true_pose[:3, :3].T, estimated_pose[:3, :3])
+    cos = np.clip((np.trace(relative_rotation) - 1) / 2, -1.0, 1.0)
+
+    return translation_error, np.degrees(np.arccos(cos))
+
+
+def run_scenario(mode, count, resolution_name, frames, noise, blur, roi_detection, detection_scale=1.0):
+    targets = single_marker_targets(count) if mode == 'single' else cube_targets(count)
+    scene = SyntheticScene(targets, RESOLUTIONS[resolution_name], noise, blur)
+
+    device_parameters_dir = tempfile.mkdtemp(prefix='ar_tracking_benchmark_')
+    try:
+        calibration_registry.save(device_parameters_dir, scene.cam_mtx, scene.dist, scene.resolution)
+        tracking = Tracking(None, None, device_parameters_dir, False, scene.detection_settings,
+                            np.eye(4), roi_detection=roi_detection, detection_scale=detection_scale)
+
+        # Frames are rendered before being read, rendering is not measured.
+        read_times = {}
+        true_poses = {}
+        rendered = {'index': 0}
+
+        def read_frame():
+            index = rendered['index']
+            if index >= frames:
+                return None
+
+            image, true_poses[index] = scene.render(index)
+            rendered['index'] += 1
+            read_times[index] = time.perf_counter()
+
+            return CapturedFrame(index, index / 30.0, image, time.monotonic(), None)
+
+        latencies = []
+        translation_errors = []
+        rotation_errors = []
+        detections = 0
+        for tracked_frame in tracking.tracked_frames(read_frame):
+            sequence = tracked_frame.captured_frame.sequence
+            latencies.append(time.perf_counter() - read_times.pop(sequence))
+
+            for target_pose, true_pose in zip(tracked_frame.estimation.target_poses, true_poses.pop(sequence)):
+                if target_pose is None:
+                    continue
+
+                detections += 1
+                translation_error, rotation_error = pose_errors(target_pose, true_pose)
+                translation_errors.append(translation_error)
+                rotation_errors.append(rotation_error)
+    finally:
+        calibration_registry.invalidate(device_parameters_dir)
+        shutil.rmtree(device_parameters_dir, ignore_errors=True)
+
+    latencies = np.array(latencies) * 1000
+
+    return {
+        'mode': mode,
+        'targets': count,
+        'resolution': resolution_name,
+        'frames': frames,
+        'fps': frames / (latencies.sum() / 1000) if latencies.sum() > 0 else 0.0,
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p95_ms': float(np.percentile(latencies, 95)),
+        'latency_p99_ms': float(np.percentile(latencies, 99)),
+        'latency_max_ms': float(latencies.max()),
+        'detection_rate': detections / (frames * count),
+        'translation_error_mean': float(np.mean(translation_errors)) if translation_errors else None,
+        'translation_error_p95': float(np.percentile(translation_errors, 95)) if translation_errors else None,
+        'rotation_error_mean_deg': float(np.mean(rotation_errors)) if rotation_errors else None,
+        'rotation_error_p95_deg': float(np.percentile(rotation_errors, 95)) if rotation_errors else None,
+        'stages': tracking.instrumentation.summary()}
+
+
+def scenario_key(result):
+    return "{} x{} {}".format(result['mode'], result['targets'], result['resolution'])
+
+
+def format_error(value):
+    return "    -" if value is None else "{:5.2f}".format(value)
+
+
+def print_report(results):
+    print("{:<22} {:>8} {:>8} {:>8} {:>8} {:>7} {:>8} {:>8}".format(
+        "scenario", "fps", "p50 ms", "p95 ms", "p99 ms", "found", "t err", "r err"))
+    for result in results:
+        print("{:<22} {:8.1f} {:8.2f} {:8.2f} {:8.2f} {:6.0%} {:>8} {:>8}".format(
+            scenario_key(result), result['fps'], result['latency_p50_ms'], result['latency_p95_ms'],
+            result['latency_p99_ms'], result['detection_rate'],
+            format_error(result['translation_error_mean']), format_error(result['rotation_error_mean_deg'])))
+
+
+def regressions(results, baseline_results, tolerance):
+    baseline = {scenario_key(result): result for result in baseline_results}
+
+    found = []
+    for result in results:
+        reference = baseline.get(scenario_key(result))
+        if reference is None:
+            continue
+
+        if result['fps'] < reference['fps'] * (1 - tolerance):
+            found.append("{}: {:.1f} fps, baseline {:.1f} fps".format(
+                scenario_key(result), result['fps'], reference['fps']))
+        if result['detection_rate'] < reference['detection_rate'] - tolerance:
+            found.append("{}: detection rate {:.0%}, baseline {:.0%}".format(
+                scenario_key(result), result['detection_rate'], reference['detection_rate']))
+
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tracks synthetic frames with known poses and reports speed and pose error.")
+    parser.add_argument('--modes', nargs='+', default=['single', 'cube'], choices=['single', 'cube'])
+    parser.add_argument('--single-counts', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--cube-counts', nargs='+', type=int, default=[1, 2])
+    parser.add_argument('--resolutions', nargs='+', default=['720p', '1080p', '4K'],
+                        choices=list(RESOLUTIONS.keys()))
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--noise', type=float, default=4.0,
+                        help="standard deviation of the gaussian noise, in gray levels")
+    parser.add_argument('--blur', type=float, default=0.8,
+                        help="sigma of the gaussian blur, in pixels")
+    parser.add_argument('--no-roi', action='store_true',
+                        help="search the whole frame for markers every frame")
+    parser.add_argument('--detection-scale', type=float, default=1.0,
+                        help="scale markers are searched at, 0 adapts it to the marker size")
+    parser.add_argument('--output', help="json file the results are written to")
+    parser.add_argument('--baseline', help="json results of a previous run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed relative fps drop and absolute detection rate drop")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        counts = args.single_counts if mode == 'single' else args.cube_counts
+        for count in counts:
+            for resolution_name in args.resolutions:
+                results.append(run_scenario(mode, count, resolution_name, args.frames,
+                                            args.noise, args.blur, not args.no_roi, args.detection_scale))
+
+    print_report(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline:
+            found = regressions(results, json.load(baseline), args.tolerance)
+
+        for regression in found:
+            print("Regression: {}".format(regression))
+
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import time
+import numpy as np
+
+CAM_MTX_FILE = "cam_mtx.npy"
+DIST_FILE = "dist.npy"
+# Width and height the camera was calibrated at, older calibrations do not have it.
+RESOLUTION_FILE = "resolution.npy"
+
+
+class CameraCalibration:
+
+    def __init__(self, cam_mtx, dist, modification_time):
+        # Intrinsics at the resolution the calibration was looked up for.
+        self.cam_mtx = cam_mtx
+        self.dist = dist
+        self.modification_time = modification_time
+        self.last_check = time.monotonic()
+
+
+class CalibrationRegistry:
+
+    def __init__(self, check_interval=1.0):
+        # Seconds between checks of the files modification time.
+        self.__check_interval = check_interval
+        self.__calibrations = {}
+
+    def camera_parameters(self, video_source_dir, resolution=None):
+        key = (video_source_dir, resolution)
+        calibration = self.__calibrations.get(key)
+
+        now = time.monotonic()
+        if calibration is not None and now - calibration.last_check < self.__check_interval:
+            return calibration.cam_mtx, calibration.dist
+
+        modification_time = self.__modification_time(video_source_dir)
+        if modification_time is None:
+            self.__calibrations.pop(key, None)
+            raise FileNotFoundError(
+                "Video source not calibrated: {}".format(video_source_dir))
+
+        if calibration is None or calibration.modification_time != modification_time:
+            cam_mtx = np.load(os.path.join(video_source_dir, CAM_MTX_FILE))
+            calibration_resolution = self.calibration_resolution(video_source_dir)
+            if resolution is not None and calibration_resolution is not None:
+                cam_mtx = scaled_camera_matrix(cam_mtx, calibration_resolution, resolution)
+
+            calibration = CameraCalibration(
+                cam_mtx, np.load(os.path.join(video_source_dir, DIST_FILE)), modification_time)
+            self.__calibrations[key] = calibration
+        else:
+            calibration.last_check = now
+
+        return calibration.cam_mtx, calibration.dist
+
+    def calibration_resolution(self, video_source_dir):
+        try:
+            return tuple(int(size) for size in np.load(os.path.join(video_source_dir, RESOLUTION_FILE)))
+        except FileNotFoundError:
+            return None
+
+    def is_calibrated(self, video_source_dir):
+        return self.__modification_time(video_source_dir) is not None
+
+    def save(self, video_source_dir, cam_mtx, dist, resolution=None):
+        if not os.path.exists(video_source_dir):
+            os.makedirs(video_source_dir)
+
+        np.save(os.path.join(video_source_dir, CAM_MTX_FILE), cam_mtx)
+        np.save(os.path.join(video_source_dir, DIST_FILE), dist)
+
+        resolution_path = os.path.join(video_source_dir, RESOLUTION_FILE)
+        if resolution is not None:
+            np.save(resolution_path, np.array(resolution, dtype=np.int64))
+        elif os.path.isfile(resolution_path):
+            os.remove(resolution_path)
+
+        self.invalidate(video_source_dir)
+
+    def delete(self, video_source_dir):
+        for file_name in (CAM_MTX_FILE, DIST_FILE, RESOLUTION_FILE):
+            path = os.path.join(video_source_dir, file_name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+        self.invalidate(video_source_dir)
+
+    def invalidate(self, video_source_dir):
+        for key in list(self.__calibrations):
+            if key[0] == video_source_dir:
+                del self.__calibrations[key]
+
+    def __modification_time(self, video_source_dir):
+        try:
+            return max(os.stat(os.path.join(video_source_dir, CAM_MTX_FILE)).st_mtime_ns,
+                       os.stat(os.path.join(video_source_dir, DIST_FILE)).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+
+def scaled_camera_matrix(cam_mtx, calibration_resolution, resolution):
+    # Focal lengths and principal point of the same camera at another resolution. Modes with
+    # another aspect ratio are usually cropped, which a scale does not describe.
+    calibration_width, calibration_height = calibration_resolution
+    width, height = resolution
+    if (width, height) == (calibration_width, calibration_height):
+        return cam_mtx
+
+    if abs(width * calibration_height - height * calibration_width) > max(calibration_width, calibration_height):
+        raise Exception("Resolution aspect ratio differs from the calibration one ({}x{}). Received: {}x{}".format(
+            calibration_width, calibration_height, width, height))
+
+    scale_x = width / calibration_width
+    scale_y = height / calibration_height
+
+    scaled = np.array(cam_mtx, dtype=np.float64)
+    scaled[0, 0] *= scale_x
+    scaled[0, 1] *= scale_x
+    scaled[1, 1] *= scale_y
+    # Pixel centers are at +0.5, the principal point is scaled around them.
+    scaled[0, 2] = (scaled[0, 2] + 0.5) * scale_x - 0.5
+    scaled[1, 2] = (scaled[1, 2] + 0.5) * scale_y - 0.5
+
+    return scaled
+
+
+# One registry per process, shared by tracking, cube mapping and the interface.
+calibration_registry = CalibrationRegistry()
@@ -0,0 +1,160 @@
+import argparse
+import collections
+import time
+import numpy as np
+import cv2
+from frame_grabber import CaptureMode, apply_capture_mode, fourcc_name
+from tracking import TrackingCofig
+
+ModeProfile = collections.namedtuple(
+    'ModeProfile', ['mode', 'supported', 'frames', 'fps', 'jitter_ms', 'dropped_frames'])
+
+# A mode is stable when its frame intervals vary less than this fraction of their mean
+# and it drops less than this fraction of its frames.
+MAX_RELATIVE_JITTER = 0.25
+MAX_DROPPED_RATIO = 0.02
+
+
+def open_capture(device_number, mode):
+    #Descomentar quando nao for utilizar o DroidCam
+    #video_capture = cv2.VideoCapture(device_number, cv2.CAP_DSHOW)
+    video_capture = cv2.VideoCapture(device_number)
+    apply_capture_mode(video_capture, mode)
+
+    return video_capture
+
+
+def measure(video_capture, duration, warmup):
+    # Frame timestamps of an unloaded read loop, after the camera settled.
+    start = time.monotonic()
+    while time.monotonic() - start < warmup:
+        if not video_capture.grab():
+            return None
+
+    timestamps = []
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        if not video_capture.grab():
+            break
+        timestamps.append(time.monotonic())
+
+    return np.array(timestamps)
+
+
+def profile_mode(device_number, mode, duration, warmup):
+    video_capture = open_capture(device_number, mode)
+    try:
+        if not video_capture.isOpened():
+            return ModeProfile(mode, False, 0, 0.0, 0.0, 0)
+
+        # Drivers silently fall back to another mode when the requested one is not offered.
+        width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fourcc = fourcc_name(video_capture.get(cv2.CAP_PROP_FOURCC))
+        if (width, height) != (mode.width, mode.height) or (mode.fourcc and fourcc != mode.fourcc):
+            return ModeProfile(mode, False, 0, 0.0, 0.0, 0)
+
+        timestamps = measure(video_capture, duration, warmup)
+    finally:
+        video_capture.release()
+
+    if timestamps is None or len(timestamps) < 3:
+        return ModeProfile(mode, False, 0, 0.0, 0.0, 0)
+
+    intervals = np.diff(timestamps)
+    # Intervals spanning several periods of the mode are frames the camera did not deliver.
+    period = np.median(intervals) if mode.fps <= 0 else min(np.median(intervals), 1 / mode.fps)
+    dropped_frames = int(np.sum(np.maximum(np.round(intervals / period) - 1, 0)))
+
+    return ModeProfile(mode, True, len(timestamps), (len(timestamps) - 1) / (timestamps[-1] - timestamps[0]),
+                       float(np.std(intervals) * 1000), dropped_frames)
+
+
+def stable(profile):
+    if not profile.supported:
+        return False
+
+    return profile.jitter_ms / 1000 <= MAX_RELATIVE_JITTER / profile.fps and \
+        profile.dropped_frames <= MAX_DROPPED_RATIO * (profile.frames + profile.dropped_frames)
+
+
+def fastest_stable(profiles, resolution=None):
+    candidates = [profile for profile in profiles if stable(profile) and
+                  (resolution is None or (profile.mode.width, profile.mode.height) == tuple(resolution))]
+
+    return max(candidates, key=lambda profile: (profile.fps, profile.mode.width * profile.mode.height), default=None)
+
+
+def format_profile(profile):
+    mode = profile.mode
+    name = "{} {}x{} @{}".format(mode.fourcc or "default", mode.width, mode.height, mode.fps or "default")
+    if not profile.supported:
+        return "{:<28} not supported".format(name)
+
+    return "{:<28} {:7.1f} fps {:7.2f} ms jitter {:5d} dropped{}".format(
+        name, profile.fps, profile.jitter_ms, profile.dropped_frames, "" if stable(profile) else "  unstable")
+
+
+def parse_resolution(text):
+    width, height = text.lower().split('x')
+
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures the frame rate, jitter and dropped frames of the capture modes of each camera "
+                    "and reports the fastest stable one.")
+    parser.add_argument('devices', nargs='*', type=int, default=[0], help="camera device numbers")
+    parser.add_argument('--fourccs', nargs='+', default=['MJPG', 'YUYV'])
+    parser.add_argument('--resolutions', nargs='+', type=parse_resolution,
+                        default=[(640, 360), (1280, 720), (1920, 1080)])
+    parser.add_argument('--fps', nargs='+', type=int, default=[30, 60])
+    parser.add_argument('--duration', type=float, default=3.0, help="seconds each mode is measured")
+    parser.add_argument('--warmup', type=float, default=1.0, help="seconds each mode runs before being measured")
+    parser.add_argument('--apply', action='store_true',
+                        help="save the fastest stable mode at the tracking capture resolution, or the fastest "
+                             "stable one, of the tracking config camera in the tracking config")
+    args = parser.parse_args()
+
+    tracking_config = TrackingCofig.persisted()
+    best_profiles = {}
+    for device_number in args.devices:
+        profiles = []
+        for fourcc in args.fourccs:
+            for width, height in args.resolutions:
+                for fps in args.fps:
+                    profile = profile_mode(device_number, CaptureMode(fourcc, width, height, fps),
+                                           args.duration, args.warmup)
+                    print("camera {}: {}".format(device_number, format_profile(profile)))
+                    profiles.append(profile)
+
+        for resolution in args.resolutions:
+            profile = fastest_stable(profiles, resolution)
+            if profile is not None:
+                print("camera {}: fastest stable at {}x{}: {}".format(
+                    device_number, resolution[0], resolution[1], format_profile(profile)))
+
+        best_profile = fastest_stable(profiles, tracking_config.capture_resolution) or fastest_stable(profiles)
+        best_profiles[device_number] = best_profile
+        if best_profile is None:
+            print("camera {}: no stable mode".format(device_number))
+        else:
+            print("camera {}: best {}".format(device_number, format_profile(best_profile)))
+
+    if args.apply:
+        best_profile = best_profiles.get(tracking_config.device_number)
+        if best_profile is None:
+            parser.error("No stable mode measured for the tracking config camera {}".format(
+                tracking_config.device_number))
+
+        mode = best_profile.mode
+        tracking_config.capture_fourcc = mode.fourcc
+        tracking_config.capture_resolution = (mode.width, mode.height)
+        tracking_config.capture_fps = mode.fps
+        tracking_config.persist()
+        print("Saved {} {}x{} @{} to the tracking config".format(mode.fourcc, mode.width, mode.height, mode.fps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import queue
+import multiprocessing
+import traceback
+from multiprocessing import Process, Queue
+
+
+def detection_worker(estimator, frame_ring, tasks, results):
+    while True:
+        try:
+            task = tasks.get(timeout=1)
+        except queue.Empty:
+            # Workers must not outlive a terminated tracking process.
+            if not multiprocessing.parent_process().is_alive():
+                break
+            continue
+
+        if task is None:
+            break
+
+        index, frame, sequence, region, scale = task
+        try:
+            estimation = worker_estimation(estimator, frame_ring, frame, sequence, region, scale)
+        except Exception:  # pylint: disable=broad-except
+            # The pool would wait forever for the result, the failure is raised there instead.
+            results.put((index, None, traceback.format_exc()))
+            continue
+
+        results.put((index, estimation, None))
+
+
+def worker_estimation(estimator, frame_ring, frame, sequence, region, scale):
+    if frame is not None:
+        return estimator.estimate(frame, region, scale)
+
+    frame = frame_ring.frame(sequence)
+    estimation = None
+    if frame is not None:
+        estimation = estimator.estimate(frame, region, scale)
+
+    if estimation is None or not frame_ring.valid(sequence):
+        # The slot was reused by a newer frame while it was being processed.
+        estimation = estimator.empty_estimation()
+
+    return estimation
+
+
+class DetectionWorkerPool:
+
+    def __init__(self, estimator, workers, max_in_flight, frame_ring=None):
+        # With a frame ring only the frame sequence is sent to the workers, not the frame.
+        self.__estimator = estimator
+        self.__frame_ring = frame_ring
+        self.__workers_count = workers
+        self.__max_in_flight = max(max_in_flight, workers)
+        self.__tasks = Queue()
+        self.__results = Queue()
+        self.__workers = []
+
+        # Frames are reassembled in submission order, not in completion order.
+        self.__submitted_count = 0
+        self.__next_index = 0
+        self.__pending_frames = {}
+        self.__completed = {}
+
+    @property
+    def in_flight(self):
+        return self.__submitted_count - self.__next_index
+
+    @property
+    def full(self):
+        return self.in_flight >= self.__max_in_flight
+
+    def start(self):
+        for _ in range(0, self.__workers_count):
+            worker = Process(target=detection_worker, args=(
+                self.__estimator, self.__frame_ring, self.__tasks, self.__results), daemon=True)
+            worker.start()
+            self.__workers.append(worker)
+
+        return self
+
+    def stop(self):
+        for _ in self.__workers:
+            self.__tasks.put(None)
+
+        for worker in self.__workers:
+            worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+
+        self.__workers = []
+
+    def submit(self, captured_frame, region=None, scale=1.0):
+        index = self.__submitted_count
+        self.__pending_frames[index] = captured_frame
+        if self.__frame_ring is None:
+            self.__tasks.put((index, captured_frame.image, None, region, scale))
+        else:
+            self.__tasks.put((index, None, captured_frame.sequence, region, scale))
+        self.__submitted_count += 1
+
+    def completed(self, block=False):
+        # Returns the (captured frame, estimation) pairs that are ready, in capture order.
+        # When block is set, waits until at least the oldest in flight frame is done.
+        while not self.__results.empty() or (block and self.__next_index not in self.__completed and self.in_flight > 0):
+            index, estimation, error = self.__results.get()
+            if error is not None:
+                raise Exception("Marker detection failed in a worker:\n{}".format(error))
+            self.__completed[index] = estimation
+
+        ready = []
+        while self.__next_index in self.__completed:
+            ready.append((self.__pending_frames.pop(self.__next_index),
+                          self.__completed.pop(self.__next_index)))
+            self.__next_index += 1
+
+        return ready
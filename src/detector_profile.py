@@ -0,0 +1,81 @@
+try:
+    import cPickle as pickle
+except ModuleNotFoundError:
+    import pickle
+
+import os
+import cv2.aruco as aruco
+
+DETECTOR_PROFILE_FILE = "detector_profile.pkl"
+
+
+class DetectorProfile:
+
+    def __init__(self, adaptive_thresh_win_size_min=3, adaptive_thresh_win_size_max=23,
+                 adaptive_thresh_win_size_step=10, adaptive_thresh_constant=7,
+                 min_marker_perimeter_rate=0.03, polygonal_approx_accuracy_rate=0.03,
+                 corner_refinement_method=aruco.CORNER_REFINE_CONTOUR):
+        # The defaults are the settings tracking always used, aruco defaults except for the
+        # threshold constant and the corner refinement.
+        self.adaptive_thresh_win_size_min = adaptive_thresh_win_size_min
+        self.adaptive_thresh_win_size_max = adaptive_thresh_win_size_max
+        self.adaptive_thresh_win_size_step = adaptive_thresh_win_size_step
+        self.adaptive_thresh_constant = adaptive_thresh_constant
+        self.min_marker_perimeter_rate = min_marker_perimeter_rate
+        self.polygonal_approx_accuracy_rate = polygonal_approx_accuracy_rate
+        self.corner_refinement_method = corner_refinement_method
+
+    def detector_parameters(self):
+        # DetectorParameters can not be pickled, so they are created where detection runs.
+        parameters = aruco.DetectorParameters_create()
+        parameters.adaptiveThreshWinSizeMin = self.adaptive_thresh_win_size_min
+        parameters.adaptiveThreshWinSizeMax = self.adaptive_thresh_win_size_max
+        parameters.adaptiveThreshWinSizeStep = self.adaptive_thresh_win_size_step
+        parameters.adaptiveThreshConstant = self.adaptive_thresh_constant
+        parameters.minMarkerPerimeterRate = self.min_marker_perimeter_rate
+        parameters.polygonalApproxAccuracyRate = self.polygonal_approx_accuracy_rate
+        parameters.cornerRefinementMethod = self.corner_refinement_method
+
+        return parameters
+
+    def settings(self):
+        return {
+            'adaptive_thresh_win_size_min': self.adaptive_thresh_win_size_min,
+            'adaptive_thresh_win_size_max': self.adaptive_thresh_win_size_max,
+            'adaptive_thresh_win_size_step': self.adaptive_thresh_win_size_step,
+            'adaptive_thresh_constant': self.adaptive_thresh_constant,
+            'min_marker_perimeter_rate': self.min_marker_perimeter_rate,
+            'polygonal_approx_accuracy_rate': self.polygonal_approx_accuracy_rate,
+            'corner_refinement_method': self.corner_refinement_method}
+
+    def changed(self, **settings):
+        profile_settings = self.settings()
+        profile_settings.update(settings)
+
+        return DetectorProfile(**profile_settings)
+
+    def __eq__(self, other):
+        return isinstance(other, DetectorProfile) and self.settings() == other.settings()
+
+    def __repr__(self):
+        return "DetectorProfile({})".format(", ".join(
+            "{}={}".format(name, value) for name, value in self.settings().items()))
+
+    @classmethod
+    def persisted(cls, video_source_dir):
+        # Cameras without a tuned profile use the defaults.
+        try:
+            with open(os.path.join(video_source_dir, DETECTOR_PROFILE_FILE), 'rb') as file:
+                profile_data = pickle.load(file)
+
+                return cls(**profile_data)
+        except FileNotFoundError:
+            return cls()
+
+    def persist(self, video_source_dir):
+        if not os.path.exists(video_source_dir):
+            os.makedirs(video_source_dir)
+
+        # Overwrites any existing file.
+        with open(os.path.join(video_source_dir, DETECTOR_PROFILE_FILE), 'wb+') as output:
+            pickle.dump(self.settings(), output, pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,213 @@
+import argparse
+import collections
+import time
+import numpy as np
+import cv2
+import cv2.aruco as aruco
+from detector_profile import DetectorProfile
+from replay import ReplaySource
+from tracking import TrackingCofig
+
+# Values tried for each group of settings. The threshold windows are (min, max, step), every
+# window size in the sweep is one more thresholding pass over the frame.
+SEARCH_SPACE = collections.OrderedDict([
+    ('adaptive threshold windows', [
+        {'adaptive_thresh_win_size_min': win_min, 'adaptive_thresh_win_size_max': win_max,
+         'adaptive_thresh_win_size_step': step}
+        for win_min, win_max, step in [(3, 23, 10), (3, 13, 10), (5, 15, 10), (7, 17, 10), (5, 25, 20),
+                                       (3, 33, 10), (7, 7, 10), (11, 11, 10), (15, 15, 10), (23, 23, 10)]]),
+    ('adaptive threshold constant', [
+        {'adaptive_thresh_constant': constant} for constant in [5, 7, 9, 11]]),
+    ('min marker perimeter rate', [
+        {'min_marker_perimeter_rate': rate} for rate in [0.01, 0.02, 0.03, 0.05, 0.08, 0.12]]),
+    ('polygonal approx accuracy rate', [
+        {'polygonal_approx_accuracy_rate': rate} for rate in [0.02, 0.03, 0.05, 0.08]]),
+    ('corner refinement', [
+        {'corner_refinement_method': method}
+        for method in [aruco.CORNER_REFINE_NONE, aruco.CORNER_REFINE_CONTOUR, aruco.CORNER_REFINE_SUBPIX]]),
+])
+
+# Changes that save less than this fraction of the detection time are measurement noise.
+MIN_IMPROVEMENT = 0.03
+
+ProfileScore = collections.namedtuple('ProfileScore', ['frame_time', 'markers', 'jitter'])
+
+
+def detect(gray_frames, profile, dictionary, marker_ids=None):
+    # Corners of the detected markers of each frame, by marker id, and the seconds per frame.
+    parameters = profile.detector_parameters()
+
+    detections = []
+    start = time.perf_counter()
+    for gray in gray_frames:
+        corners, ids, _ = aruco.detectMarkers(gray, dictionary, parameters=parameters)
+        detections.append({} if ids is None else {
+            int(marker_id[0]): np.reshape(marker_corners, (4, 2))
+            for marker_corners, marker_id in zip(corners, ids)})
+    frame_time = (time.perf_counter() - start) / len(gray_frames)
+
+    if marker_ids is not None:
+        detections = [{marker_id: corners for marker_id, corners in frame_detections.items()
+                       if marker_id in marker_ids} for frame_detections in detections]
+
+    return detections, frame_time
+
+
+def corner_jitter(detections):
+    # Mean second difference of the corners over consecutive frames, in pixels. Smooth motion
+    # barely changes it, noisy corners do.
+    differences = []
+    for previous, current, following in zip(detections, detections[1:], detections[2:]):
+        for marker_id, corners in current.items():
+            if marker_id in previous and marker_id in following:
+                differences.append(np.linalg.norm(
+                    following[marker_id] - 2 * corners + previous[marker_id], axis=1).mean())
+
+    return float(np.mean(differences)) if differences else 0.0
+
+
+def score(gray_frames, profile, dictionary, marker_ids, repeats):
+    # The fastest of the repeats is kept, it is the least disturbed by the rest of the system.
+    frame_time = None
+    for _ in range(0, repeats):
+        detections, repeat_frame_time = detect(gray_frames, profile, dictionary, marker_ids)
+        if frame_time is None or repeat_frame_time < frame_time:
+            frame_time = repeat_frame_time
+
+    return ProfileScore(frame_time, sum(len(frame_detections) for frame_detections in detections),
+                        corner_jitter(detections))
+
+
+class DetectorTuning:
+
+    def __init__(self, gray_frames, reference_profile, detection_tolerance=0.0, jitter_tolerance=0.1,
+                 repeats=2, max_passes=3):
+        # Profiles must find as many markers as the reference profile, with as little jitter,
+        # the fastest one wins.
+        self.__gray_frames = gray_frames
+        self.__reference_profile = reference_profile
+        self.__detection_tolerance = detection_tolerance
+        self.__jitter_tolerance = jitter_tolerance
+        self.__repeats = repeats
+        self.__max_passes = max_passes
+        self.__dictionary = aruco.Dictionary_get(aruco.DICT_6X6_250)
+
+        # Only the markers the reference profile finds are counted, anything else found by a
+        # looser profile is more likely a false detection than a missed marker.
+        detections, _ = detect(gray_frames, reference_profile, self.__dictionary)
+        self.__marker_ids = set(marker_id for frame_detections in detections
+                                for marker_id in frame_detections)
+        self.reference_score = self.__score(reference_profile)
+
+    def acceptable(self, profile_score):
+        reference_score = self.reference_score
+
+        return profile_score.markers >= reference_score.markers * (1 - self.__detection_tolerance) and \
+            profile_score.jitter <= reference_score.jitter * (1 + self.__jitter_tolerance) + 0.01
+
+    def tune(self, report=print):
+        # Coordinate descent, one group of settings at a time, until a whole pass changes nothing.
+        best_profile = self.__reference_profile
+        best_score = self.reference_score
+        report(format_score("reference", best_score))
+
+        for _ in range(0, self.__max_passes):
+            improved = False
+            for name, options in SEARCH_SPACE.items():
+                for settings in options:
+                    profile = best_profile.changed(**settings)
+                    if profile == best_profile:
+                        continue
+
+                    profile_score = self.__score(profile)
+                    accepted = self.acceptable(profile_score) and \
+                        profile_score.frame_time < best_score.frame_time * (1 - MIN_IMPROVEMENT)
+                    report(format_score("{} {}".format(name, list(settings.values())), profile_score,
+                                        accepted))
+
+                    if accepted:
+                        best_profile = profile
+                        best_score = profile_score
+                        improved = True
+
+            if not improved:
+                break
+
+        return best_profile, best_score
+
+    def __score(self, profile):
+        return score(self.__gray_frames, profile, self.__dictionary, self.__marker_ids, self.__repeats)
+
+
+def format_score(name, profile_score, accepted=False):
+    return "{:<50} {:8.2f} ms {:7d} markers {:6.3f} px jitter{}".format(
+        name, profile_score.frame_time * 1000, profile_score.markers, profile_score.jitter,
+        " *" if accepted else "")
+
+
+def read_gray_frames(source, max_frames):
+    gray_frames = []
+    try:
+        while len(gray_frames) < max_frames:
+            captured_frame = source.read()
+            if captured_frame is None:
+                break
+            gray_frames.append(cv2.cvtColor(captured_frame.image, cv2.COLOR_BGR2GRAY))
+    finally:
+        source.release()
+
+    return gray_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Searches the marker detector settings that detect fastest on recorded footage "
+                    "without losing detections or corner accuracy, and saves them for the camera.")
+    parser.add_argument('source', help="video file or directory of images recorded with the camera")
+    parser.add_argument('--device-parameters-dir',
+                        help="camera calibration directory the profile is saved to, the tracking config one by default")
+    parser.add_argument('--frames', type=int, default=300,
+                        help="frames of the recording used")
+    parser.add_argument('--repeats', type=int, default=2,
+                        help="times each profile is timed")
+    parser.add_argument('--detection-tolerance', type=float, default=0.0,
+                        help="fraction of the reference detections a profile may lose")
+    parser.add_argument('--jitter-tolerance', type=float, default=0.1,
+                        help="relative corner jitter increase a profile may have")
+    parser.add_argument('--from-defaults', action='store_true',
+                        help="start from the default settings instead of the saved profile")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="report the best profile without saving it")
+    args = parser.parse_args()
+
+    device_parameters_dir = args.device_parameters_dir or TrackingCofig.persisted().device_parameters_dir
+    if not device_parameters_dir:
+        parser.error("No camera selected, pass --device-parameters-dir")
+
+    gray_frames = read_gray_frames(ReplaySource(args.source), args.frames)
+    if len(gray_frames) < 3:
+        parser.error("The recording has less than 3 frames")
+
+    reference_profile = DetectorProfile() if args.from_defaults \
+        else DetectorProfile.persisted(device_parameters_dir)
+
+    tuning = DetectorTuning(gray_frames, reference_profile, args.detection_tolerance,
+                            args.jitter_tolerance, args.repeats)
+    if tuning.reference_score.markers == 0:
+        parser.error("No markers found in the recording")
+
+    profile, profile_score = tuning.tune()
+
+    print()
+    print(format_score("best", profile_score))
+    print("{:.1f}x faster than the reference".format(
+        tuning.reference_score.frame_time / profile_score.frame_time))
+    print(profile)
+
+    if not args.dry_run:
+        profile.persist(device_parameters_dir)
+        print("Saved to {}".format(device_parameters_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import collections
+import threading
+import time
+import numpy as np
+import cv2
+
+# timestamp is the time base of the pose filters. read_timestamp is the monotonic time the frame was
+# read at, latencies are measured from it, and device_timestamp the backend one in seconds, None
+# when the backend has none.
+CapturedFrame = collections.namedtuple(
+    'CapturedFrame', ['sequence', 'timestamp', 'image', 'read_timestamp', 'device_timestamp'])
+
+# Empty fourcc and 0 fps leave the driver defaults.
+CaptureMode = collections.namedtuple('CaptureMode', ['fourcc', 'width', 'height', 'fps'])
+
+
+def apply_capture_mode(video_capture, mode):
+    # The format is set first, some drivers only offer the larger sizes and rates once it is.
+    if mode.fourcc:
+        video_capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode.fourcc))
+    video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, mode.width)
+    video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, mode.height)
+    if mode.fps > 0:
+        video_capture.set(cv2.CAP_PROP_FPS, mode.fps)
+    video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+
+def fourcc_name(code):
+    code = int(code)
+
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(0, 4))
+
+
+def device_frame_timestamp(video_capture):
+    # Backends without frame timestamps report 0 or -1.
+    position = video_capture.get(cv2.CAP_PROP_POS_MSEC)
+
+    return position / 1000 if position > 0 else None
+
+
+class FrameGrabber:
+
+    def __init__(self, video_capture, buffer_size=2, frame_ring=None):
+        self.__video_capture = video_capture
+        self.__frame_ring = frame_ring
+        self.__frames = collections.deque(maxlen=buffer_size)
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__running = False
+        self.__sequence = 0
+        self.__dropped_frames = 0
+
+    @property
+    def dropped_frames(self):
+        return self.__dropped_frames
+
+    def start(self):
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__grab, daemon=True)
+        self.__thread.start()
+
+        return self
+
+    def stop(self):
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def read(self, timeout=None):
+        # Always returns the newest frame, frames older than it are discarded.
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: len(self.__frames) > 0 or not self.__running, timeout)
+
+            if len(self.__frames) == 0:
+                return None
+
+            frame = self.__frames.pop()
+            self.__dropped_frames += len(self.__frames)
+            self.__frames.clear()
+
+            return frame
+
+    def __grab(self):
+        while self.__running:
+            if self.__frame_ring is None:
+                grabbed, image = self.__video_capture.read()
+            else:
+                # Captures straight into the shared memory slot, so the frame is never copied.
+                slot = self.__frame_ring.begin_write(self.__sequence)
+                grabbed, image = self.__video_capture.read(slot)
+                if grabbed and image is not slot:
+                    np.copyto(slot, image)
+                    image = slot
+
+            timestamp = time.monotonic()
+            device_timestamp = device_frame_timestamp(self.__video_capture)
+
+            with self.__condition:
+                if not grabbed:
+                    self.__running = False
+                    self.__condition.notify_all()
+                    break
+
+                if len(self.__frames) == self.__frames.maxlen:
+                    self.__dropped_frames += 1
+
+                if self.__frame_ring is not None:
+                    self.__frame_ring.end_write(self.__sequence)
+
+                self.__frames.append(CapturedFrame(
+                    self.__sequence, timestamp, image, timestamp, device_timestamp))
+                self.__sequence += 1
+
+                self.__condition.notify()
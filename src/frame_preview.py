@@ -0,0 +1,122 @@
+import collections
+import time
+import numpy as np
+import cv2
+import cv2.aruco as aruco
+from queue import Empty
+from shared_frame_ring import SharedFrameRing
+from calibration_registry import calibration_registry
+from pose_packet import POSE_FIELDS
+import geometry
+
+# What the tracking process publishes for the preview, the frame itself is read from the frame ring.
+PreviewData = collections.namedtuple(
+    'PreviewData', ['sequence', 'corners', 'target_poses', 'detection_result', 'dropped_frames',
+                    'instrumentation_lines'])
+
+
+class FramePreview:
+
+    def __init__(self, frame_ring_name, preview_queue, quit_event, device_parameters_dir, preview_rate=15):
+        # Runs in its own process, so drawing and window events never slow the tracking loop.
+        self.__frame_ring_name = frame_ring_name
+        self.__preview_queue = preview_queue
+        self.__quit_event = quit_event
+        self.__device_parameters_dir = device_parameters_dir
+        self.__preview_rate = preview_rate
+
+    def show(self):
+        frame_ring = self.__attach_frame_ring()
+        if frame_ring is None:
+            return
+
+        win_name = "Tracking"
+        cv2.namedWindow(win_name, cv2.WND_PROP_FULLSCREEN)
+        cv2.setWindowProperty(
+            win_name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+
+        period = 1.0 / self.__preview_rate
+        preview_data = None
+        try:
+            while not self.__quit_event.is_set():
+                start = time.monotonic()
+
+                try:
+                    preview_data = self.__preview_queue.get_nowait()
+                except Empty:
+                    pass
+
+                if preview_data is not None:
+                    frame = frame_ring.frame(preview_data.sequence)
+                    if frame is not None:
+                        frame = frame.copy()
+                        # The slot may have been overwritten while it was copied.
+                        if frame_ring.valid(preview_data.sequence):
+                            self.__draw(frame, preview_data)
+                            cv2.imshow(win_name, frame)
+
+                remaining = period - (time.monotonic() - start)
+                if cv2.waitKey(max(int(remaining * 1000), 1)) & 0xFF == ord('q'):
+                    self.__quit_event.set()
+        finally:
+            cv2.destroyAllWindows()
+            frame_ring.close()
+
+    def __attach_frame_ring(self):
+        # The tracking process creates the ring once the camera is open.
+        while not self.__quit_event.is_set():
+            try:
+                return SharedFrameRing.attach(self.__frame_ring_name, shares_tracker=True)
+            except FileNotFoundError:
+                time.sleep(0.1)
+
+        return None
+
+    def __draw(self, frame, preview_data):
+        detection_result = preview_data.detection_result
+
+        if len(preview_data.corners) > 0:
+            aruco.drawDetectedMarkers(frame, preview_data.corners)
+
+        if any(target_pose is not None for target_pose in preview_data.target_poses):
+            cam_mtx, dist = calibration_registry.camera_parameters(
+                self.__device_parameters_dir, (frame.shape[1], frame.shape[0]))
+            for target_pose in preview_data.target_poses:
+                if target_pose is not None:
+                    aruco.drawAxis(frame, cam_mtx, dist,
+                                   geometry.rotation_matrices_to_rodrigues(target_pose[:3, :3])[0],
+                                   np.ascontiguousarray(target_pose[:3, 3]), 5)
+
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        font_scale = 0.6
+        font_color = (0, 255, 0)
+
+        cv2.putText(frame, 'timestamp: {}'.format(detection_result['timestamp']), (0, 20),
+                    font, font_scale, font_color, 2, cv2.LINE_AA)
+        cv2.putText(frame, 'success: {}'.format(detection_result['success']), (0, 40),
+                    font, font_scale, font_color, 2, cv2.LINE_AA)
+
+        if 'targets' in detection_result:
+            for i, target in enumerate(detection_result['targets']):
+                if target['success']:
+                    text = '{}: {:.2f} {:.2f} {:.2f}'.format(
+                        target['name'], target['translation_x'], target['translation_y'], target['translation_z'])
+                else:
+                    text = '{}: not found'.format(target['name'])
+
+                cv2.putText(frame, text, (0, 60 + 20 * i),
+                            font, font_scale, font_color, 2, cv2.LINE_AA)
+        elif detection_result['success']:
+            for i, field in enumerate(POSE_FIELDS):
+                cv2.putText(frame, '{}: {:.2f}'.format(field, detection_result[field]), (0, 60 + 20 * i),
+                            font, font_scale, font_color, 2, cv2.LINE_AA)
+
+        cv2.putText(frame, 'dropped frames: {}'.format(preview_data.dropped_frames), (0, 305),
+                    font, font_scale, font_color, 2, cv2.LINE_AA)
+
+        cv2.putText(frame, "Q - Quit ", (0, 330), font,
+                    font_scale, font_color, 2, cv2.LINE_AA)
+
+        for i, line in enumerate(preview_data.instrumentation_lines):
+            cv2.putText(frame, line, (0, 360 + 20 * i), font,
+                        font_scale, font_color, 2, cv2.LINE_AA)
@@ -0,0 +1,204 @@
+import numpy as np
+
+# Every function works on batches: rotation vectors and translations are (N, 3),
+# rotation matrices (N, 3, 3) and poses (N, 4, 4).
+
+
+def rodrigues_to_rotation_matrices(rvecs):
+    rvecs = np.reshape(rvecs, (-1, 3)).astype(np.float64)
+
+    theta = np.linalg.norm(rvecs, axis=1)
+    small = theta < 1e-12
+    axes = rvecs / np.where(small, 1.0, theta)[:, None]
+
+    cross = np.zeros((rvecs.shape[0], 3, 3))
+    cross[:, 0, 1] = -axes[:, 2]
+    cross[:, 0, 2] = axes[:, 1]
+    cross[:, 1, 0] = axes[:, 2]
+    cross[:, 1, 2] = -axes[:, 0]
+    cross[:, 2, 0] = -axes[:, 1]
+    cross[:, 2, 1] = axes[:, 0]
+
+    sin = np.sin(theta)[:, None, None]
+    cos = np.cos(theta)[:, None, None]
+
+    return np.eye(3) + sin * cross + (1 - cos) * np.matmul(cross, cross)
+
+
+def rotation_matrices_to_rodrigues(rotations):
+    rotations = np.reshape(rotations, (-1, 3, 3))
+
+    cos = np.clip((np.trace(rotations, axis1=1, axis2=2) - 1) / 2, -1.0, 1.0)
+    theta = np.arccos(cos)
+    sin = np.sin(theta)
+
+    skew = np.stack((rotations[:, 2, 1] - rotations[:, 1, 2],
+                     rotations[:, 0, 2] - rotations[:, 2, 0],
+                     rotations[:, 1, 0] - rotations[:, 0, 1]), axis=1)
+
+    # theta / (2 sin(theta)) tends to 1/2 for small angles.
+    regular = sin > 1e-6
+    scale = np.where(regular, theta / (2 * np.where(regular, sin, 1.0)), 0.5)
+    rvecs = skew * scale[:, None]
+
+    # Close to pi the skew part vanishes, the axis comes from (R + I) / 2 = a a^T.
+    half_turn = np.logical_and(~regular, cos < 0)
+    if np.any(half_turn):
+        symmetric = (rotations[half_turn] + np.eye(3)) / 2
+        diagonal = np.diagonal(symmetric, axis1=1, axis2=2)
+        column = np.argmax(diagonal, axis=1)
+        indexes = np.arange(symmetric.shape[0])
+        axes = symmetric[indexes, :, column] / \
+            np.sqrt(np.maximum(diagonal[indexes, column], 1e-12))[:, None]
+        rvecs[half_turn] = axes * theta[half_turn][:, None]
+
+    return rvecs
+
+
+def pose_matrices(rvecs, tvecs):
+    rotations = rodrigues_to_rotation_matrices(rvecs)
+
+    poses = np.zeros((rotations.shape[0], 4, 4))
+    poses[:, :3, :3] = rotations
+    poses[:, :3, 3] = np.reshape(tvecs, (-1, 3))
+    poses[:, 3, 3] = 1
+
+    return poses
+
+
+def rigid_inverse(poses):
+    poses = np.reshape(poses, (-1, 4, 4))
+    rotations_t = np.transpose(poses[:, :3, :3], (0, 2, 1))
+
+    inverses = np.zeros(poses.shape)
+    inverses[:, :3, :3] = rotations_t
+    inverses[:, :3, 3] = -np.matmul(rotations_t, poses[:, :3, 3, None])[:, :, 0]
+    inverses[:, 3, 3] = 1
+
+    return inverses
+
+
+def compose(poses, transformations):
+    return np.matmul(poses, transformations)
+
+
+def rotation_matrices_to_euler(rotations):
+    rotations = np.reshape(rotations, (-1, 3, 3))
+
+    sy = np.sqrt(rotations[:, 0, 0] ** 2 + rotations[:, 1, 0] ** 2)
+    singular = sy < 1e-6
+
+    x = np.where(singular,
+                 np.arctan2(-rotations[:, 1, 2], rotations[:, 1, 1]),
+                 np.arctan2(rotations[:, 2, 1], rotations[:, 2, 2]))
+    y = np.arctan2(-rotations[:, 2, 0], sy)
+    z = np.where(singular, 0.0, np.arctan2(
+        rotations[:, 1, 0], rotations[:, 0, 0]))
+
+    return np.stack((x, y, z), axis=1)
+
+
+def euler_to_rotation_matrices(thetas):
+    thetas = np.reshape(thetas, (-1, 3))
+    cos = np.cos(thetas)
+    sin = np.sin(thetas)
+    count = thetas.shape[0]
+
+    rotations_x = np.zeros((count, 3, 3))
+    rotations_x[:, 0, 0] = 1
+    rotations_x[:, 1, 1] = cos[:, 0]
+    rotations_x[:, 1, 2] = -sin[:, 0]
+    rotations_x[:, 2, 1] = sin[:, 0]
+    rotations_x[:, 2, 2] = cos[:, 0]
+
+    rotations_y = np.zeros((count, 3, 3))
+    rotations_y[:, 0, 0] = cos[:, 1]
+    rotations_y[:, 0, 2] = sin[:, 1]
+    rotations_y[:, 1, 1] = 1
+    rotations_y[:, 2, 0] = -sin[:, 1]
+    rotations_y[:, 2, 2] = cos[:, 1]
+
+    rotations_z = np.zeros((count, 3, 3))
+    rotations_z[:, 0, 0] = cos[:, 2]
+    rotations_z[:, 0, 1] = -sin[:, 2]
+    rotations_z[:, 1, 0] = sin[:, 2]
+    rotations_z[:, 1, 1] = cos[:, 2]
+    rotations_z[:, 2, 2] = 1
+
+    return np.matmul(rotations_z, np.matmul(rotations_y, rotations_x))
+
+
+def rotation_matrices_to_quaternions(rotations):
+    # Quaternions are (w, x, y, z). Each one is computed from its largest component,
+    # which keeps the square root away from zero.
+    rotations = np.reshape(rotations, (-1, 3, 3))
+    r00, r11, r22 = rotations[:, 0, 0], rotations[:, 1, 1], rotations[:, 2, 2]
+    trace = r00 + r11 + r22
+
+    largest = np.argmax(np.stack((trace, r00, r11, r22), axis=1), axis=1)
+    quaternions = np.zeros((rotations.shape[0], 4))
+
+    case = largest == 0
+    s = np.sqrt(np.maximum(trace[case] + 1, 1e-12)) * 2
+    quaternions[case, 0] = s / 4
+    quaternions[case, 1] = (rotations[case, 2, 1] - rotations[case, 1, 2]) / s
+    quaternions[case, 2] = (rotations[case, 0, 2] - rotations[case, 2, 0]) / s
+    quaternions[case, 3] = (rotations[case, 1, 0] - rotations[case, 0, 1]) / s
+
+    case = largest == 1
+    s = np.sqrt(np.maximum(1 + r00[case] - r11[case] - r22[case], 1e-12)) * 2
+    quaternions[case, 0] = (rotations[case, 2, 1] - rotations[case, 1, 2]) / s
+    quaternions[case, 1] = s / 4
+    quaternions[case, 2] = (rotations[case, 0, 1] + rotations[case, 1, 0]) / s
+    quaternions[case, 3] = (rotations[case, 0, 2] + rotations[case, 2, 0]) / s
+
+    case = largest == 2
+    s = np.sqrt(np.maximum(1 + r11[case] - r00[case] - r22[case], 1e-12)) * 2
+    quaternions[case, 0] = (rotations[case, 0, 2] - rotations[case, 2, 0]) / s
+    quaternions[case, 1] = (rotations[case, 0, 1] + rotations[case, 1, 0]) / s
+    quaternions[case, 2] = s / 4
+    quaternions[case, 3] = (rotations[case, 1, 2] + rotations[case, 2, 1]) / s
+
+    case = largest == 3
+    s = np.sqrt(np.maximum(1 + r22[case] - r00[case] - r11[case], 1e-12)) * 2
+    quaternions[case, 0] = (rotations[case, 1, 0] - rotations[case, 0, 1]) / s
+    quaternions[case, 1] = (rotations[case, 0, 2] + rotations[case, 2, 0]) / s
+    quaternions[case, 2] = (rotations[case, 1, 2] + rotations[case, 2, 1]) / s
+    quaternions[case, 3] = s / 4
+
+    return quaternions
+
+
+def quaternions_to_rotation_matrices(quaternions):
+    quaternions = np.reshape(quaternions, (-1, 4))
+    quaternions = quaternions / \
+        np.linalg.norm(quaternions, axis=1)[:, None]
+    w, x, y, z = quaternions.T
+
+    rotations = np.empty((quaternions.shape[0], 3, 3))
+    rotations[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    rotations[:, 0, 1] = 2 * (x * y - z * w)
+    rotations[:, 0, 2] = 2 * (x * z + y * w)
+    rotations[:, 1, 0] = 2 * (x * y + z * w)
+    rotations[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    rotations[:, 1, 2] = 2 * (y * z - x * w)
+    rotations[:, 2, 0] = 2 * (x * z - y * w)
+    rotations[:, 2, 1] = 2 * (y * z + x * w)
+    rotations[:, 2, 2] = 1 - 2 * (x * x + y * y)
+
+    return rotations
+
+
+def mean_pose(poses):
+    # Chordal mean: the mean rotation matrix projected back onto the rotations, and the mean
+    # translation. Close to the geodesic mean for poses as close to each other as repeated
+    # measurements of the same transformation.
+    poses = np.reshape(poses, (-1, 4, 4))
+    u, _, vt = np.linalg.svd(poses[:, :3, :3].sum(axis=0))
+    correction = np.diag([1, 1, np.sign(np.linalg.det(np.dot(u, vt)))])
+
+    mean = np.eye(4)
+    mean[:3, :3] = np.dot(np.dot(u, correction), vt)
+    mean[:3, 3] = poses[:, :3, 3].mean(axis=0)
+
+    return mean
@@ -0,0 +1,156 @@
+import bisect
+import collections
+import json
+import os
+import time
+
+# Upper bounds of the histogram buckets in seconds, each 25% above the previous one, from
+# 10 us to about 2 s. The last bucket holds everything slower.
+BUCKET_BOUNDS = tuple(0.00001 * 1.25 ** i for i in range(0, 56))
+
+INSTRUMENTATION_DIR = '../assets/instrumentation/'
+
+
+class LatencyHistogram:
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.__bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.__bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.count == 1 or seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, percentile):
+        # Interpolated inside the bucket the percentile falls in.
+        if self.count == 0:
+            return 0.0
+
+        rank = percentile / 100 * self.count
+        cumulative = 0
+        lower_bound = 0.0
+        for bound, count in zip(self.__bounds, self.counts):
+            if count > 0 and cumulative + count >= rank:
+                value = lower_bound + (bound - lower_bound) * (rank - cumulative) / count
+                return min(value, self.maximum)
+            cumulative += count
+            lower_bound = bound
+
+        return self.maximum
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'min_ms': self.minimum * 1000,
+            'mean_ms': self.mean * 1000,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.maximum * 1000,
+            'buckets_ms': [bound * 1000 for bound in self.__bounds],
+            'counts': list(self.counts)}
+
+
+class StageTimer:
+
+    def __init__(self, histogram):
+        self.__histogram = histogram
+        self.__start = 0.0
+
+    def __enter__(self):
+        self.__start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__histogram.record(time.perf_counter() - self.__start)
+
+
+class Instrumentation:
+
+    def __init__(self, name, enabled=True, dump_interval=5.0):
+        self.name = name
+        self.enabled = enabled
+        self.__dump_interval = dump_interval
+        self.__histograms = collections.OrderedDict()
+        self.__timers = {}
+        self.__last_dump = time.monotonic()
+
+    def histogram(self, stage):
+        histogram = self.__histograms.get(stage)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.__histograms[stage] = histogram
+            self.__timers[stage] = StageTimer(histogram)
+
+        return histogram
+
+    def record(self, stage, seconds):
+        if self.enabled:
+            self.histogram(stage).record(seconds)
+
+    def record_all(self, timings):
+        if self.enabled:
+            for stage, seconds in timings.items():
+                self.histogram(stage).record(seconds)
+
+    def measure(self, stage):
+        # with instrumentation.measure('stage'): ... records the time spent in the block.
+        if not self.enabled:
+            return NULL_TIMER
+
+        self.histogram(stage)
+        return self.__timers[stage]
+
+    def summary(self):
+        return collections.OrderedDict(
+            (stage, histogram.summary()) for stage, histogram in self.__histograms.items())
+
+    def report_lines(self):
+        return ["{}: min {:.2f} ms, avg {:.2f} ms, p50 {:.2f} ms, p99 {:.2f} ms".format(
+            stage, histogram.minimum * 1000, histogram.mean * 1000, histogram.percentile(50) * 1000,
+            histogram.percentile(99) * 1000)
+                for stage, histogram in self.__histograms.items()]
+
+    def dump(self, path=None):
+        if path is None:
+            if not os.path.exists(INSTRUMENTATION_DIR):
+                os.makedirs(INSTRUMENTATION_DIR)
+            path = os.path.join(INSTRUMENTATION_DIR, '{}.json'.format(self.name))
+
+        with open(path, 'w') as output:
+            json.dump(self.summary(), output, indent=2)
+
+    def dump_periodically(self):
+        # Processes are terminated when tracking stops, so the histograms are also dumped while running.
+        if not self.enabled:
+            return
+
+        now = time.monotonic()
+        if now - self.__last_dump >= self.__dump_interval:
+            self.__last_dump = now
+            self.dump()
+
+
+class NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
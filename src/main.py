@@ -5,10 +5,17 @@ import multiprocessing
 import time
 import numpy as np
 from video_source_calibration import VideoSourceCalibration, VideoSourceCalibrationConfig
-from tracking import TrackingScheduler, TrackingCofig
-from marker_detection_settings import CUBE_DETECTION, SINGLE_DETECTION, SingleMarkerDetectionSettings, MarkersCubeDetectionSettings, MarkerCubeMapping
+from tracking import TrackingScheduler, TrackingCofig, AUTO_DETECTION_SCALE
+from marker_detection_settings import CUBE_DETECTION, SINGLE_DETECTION, MULTI_DETECTION, SingleMarkerDetectionSettings, MarkersCubeDetectionSettings, MultiTargetDetectionSettings, MarkerCubeMapping, single_marker_target_name
+from calibration_registry import calibration_registry
+from pose_packet import JSON_FORMAT, BINARY_FORMAT
 import video_device_listing
 
+CAPTURE_RESOLUTIONS = [(640, 360), (960, 540), (1280, 720), (1920, 1080)]
+# The empty fourcc keeps the driver default.
+CAPTURE_FOURCCS = [("Default", ""), ("MJPG", "MJPG"), ("YUYV", "YUYV")]
+DETECTION_SCALES = [("Full", 1.0), ("1/2", 0.5), ("1/4", 0.25), ("Auto", AUTO_DETECTION_SCALE)]
+
 
 class App():
 
@@ -19,7 +26,8 @@ class App():
         window.title("AR Tracking Interface")
 
         width = 500
-        height = 700
+        # The settings scroll on screens too small for all of them, down to 768 px high.
+        height = min(960, window.winfo_screenheight() - 80)
         pos_x = (window.winfo_screenwidth()/2) - (width/2)
         pos_y = (window.winfo_screenheight()/2) - (height/2)
         window.geometry('%dx%d+%d+%d' % (width, height, pos_x, pos_y))
@@ -30,13 +38,28 @@ class App():
         window['pady'] = 5
 
         window.grid_rowconfigure(1, weight=1)
-        window.grid_rowconfigure(2, weight=1)
-        window.grid_rowconfigure(3, weight=1)
-        window.grid_rowconfigure(4, weight=1)
         window.grid_columnconfigure(1, weight=1)
 
+        self.settings_canvas = tk.Canvas(window, highlightthickness=0)
+        self.settings_canvas.grid(row=1, column=1, sticky=tk.NSEW)
+        self.settings_scrollbar = ttk.Scrollbar(
+            window, orient=tk.VERTICAL, command=self.settings_canvas.yview)
+        self.settings_scrollbar.grid(row=1, column=2, sticky=tk.NS)
+        self.settings_canvas['yscrollcommand'] = self.settings_scrollbar.set
+
+        self.settings_frame = tk.Frame(self.settings_canvas)
+        self.settings_frame_item = self.settings_canvas.create_window(
+            (0, 0), window=self.settings_frame, anchor=tk.NW)
+        self.settings_frame.bind('<Configure>', self.settings_frame_resized)
+        self.settings_canvas.bind('<Configure>', self.settings_canvas_resized)
+        window.bind_all('<MouseWheel>', self.settings_scrolled)
+
+        self.settings_frame.grid_rowconfigure(1, weight=1)
+        self.settings_frame.grid_rowconfigure(2, weight=1)
+        self.settings_frame.grid_columnconfigure(1, weight=1)
+
         self.video_source_frame = ttk.LabelFrame(
-            window, text="Video Source")
+            self.settings_frame, text="Video Source")
         self.video_source_frame.grid(row=1, column=1, pady=5, padx=5)
         self.video_source_frame.grid_columnconfigure(1, weight=1)
 
@@ -99,7 +122,7 @@ class App():
             self.calibration_buttons_frame, text="Reset", command=self.reset_calibration)
         self.calibrate_button.grid(row=1, column=2, padx=5)
 
-        self.configuration_frame = tk.Frame(window)
+        self.configuration_frame = tk.Frame(self.settings_frame)
         self.configuration_frame.grid(
             row=2, column=1)
 
@@ -256,6 +279,33 @@ class App():
             self.marker_cube_buttons_frame, text="Delete", command=self.marker_cube_delete)
         self.marker_cube_id_delete_button.grid(row=1, column=2, padx=5)
 
+        self.multi_target_frame = ttk.LabelFrame(
+            self.detection_mode_frame, text="Multi Target")
+        self.multi_target_frame.grid(
+            row=2, column=1, columnspan=2, padx=5, pady=5)
+
+        self.multi_target_mode = tk.BooleanVar()
+        self.multi_target_mode_checkbox = tk.Checkbutton(
+            self.multi_target_frame, variable=self.multi_target_mode,
+            command=self.multi_target_settings_selection)
+        self.multi_target_mode_checkbox.grid(row=1, column=1, pady=5)
+
+        self.multi_target_settings_frame = tk.Frame(self.multi_target_frame)
+        self.multi_target_settings_frame.grid(
+            row=2, column=1, padx=5, pady=5)
+
+        self.multi_target_single_marker = tk.BooleanVar()
+        self.multi_target_single_marker_checkbox = tk.Checkbutton(
+            self.multi_target_settings_frame, text="Single marker",
+            variable=self.multi_target_single_marker)
+        self.multi_target_single_marker_checkbox.grid(
+            row=1, column=1, sticky=tk.W + tk.N)
+
+        self.multi_target_cubes = tk.Listbox(
+            self.multi_target_settings_frame, selectmode=tk.MULTIPLE,
+            exportselection=False, height=3, width=20)
+        self.multi_target_cubes.grid(row=1, column=2, padx=5)
+
         self.single_marker_settings = SingleMarkerDetectionSettings.persisted()
         self.single_marker_settings_set()
 
@@ -269,6 +319,12 @@ class App():
         elif self.tracking_config.marker_detection_settings.identifier == CUBE_DETECTION:
             self.marker_cube_mode.set(True)
             self.marker_cube_settings_selection()
+        elif self.tracking_config.marker_detection_settings.identifier == MULTI_DETECTION:
+            self.multi_target_single_marker.set(any(
+                settings.identifier == SINGLE_DETECTION
+                for _, settings in self.tracking_config.marker_detection_settings.targets))
+            self.multi_target_mode.set(True)
+            self.multi_target_settings_selection()
 
         self.translation_offset_frame = ttk.LabelFrame(
             self.tracking_config_frame, text="Translation Offset")
@@ -334,15 +390,130 @@ class App():
             self.export_coordinates_input_frame, textvariable=self.server_port, width=7)
         self.server_port_entry.grid(row=1, column=4)
 
+        self.wire_format_label = ttk.Label(
+            self.export_coordinates_input_frame, text="Format:")
+        self.wire_format_label.grid(row=2, column=1, pady=5)
+        self.wire_format = ttk.Combobox(
+            self.export_coordinates_input_frame, state="readonly", width=12,
+            values=[JSON_FORMAT, BINARY_FORMAT])
+        self.wire_format.set(self.tracking_config.wire_format)
+        self.wire_format.grid(row=2, column=2, sticky=tk.W, pady=5)
+
+        self.prediction_lead = tk.IntVar()
+        self.prediction_lead.set(
+            int(round(self.tracking_config.prediction_lead * 1000)))
+        self.prediction_lead_label = ttk.Label(
+            self.export_coordinates_input_frame, text="Lead (ms):")
+        self.prediction_lead_label.grid(row=3, column=1, pady=5)
+        self.prediction_lead_entry = ttk.Entry(
+            self.export_coordinates_input_frame, textvariable=self.prediction_lead, width=7)
+        self.prediction_lead_entry.grid(row=3, column=2, sticky=tk.W, pady=5)
+
+        self.output_rate = tk.IntVar()
+        self.output_rate.set(self.tracking_config.output_rate)
+        self.output_rate_label = ttk.Label(
+            self.export_coordinates_input_frame, text="Rate (Hz):")
+        self.output_rate_label.grid(row=3, column=3, pady=5)
+        self.output_rate_entry = ttk.Entry(
+            self.export_coordinates_input_frame, textvariable=self.output_rate, width=7)
+        self.output_rate_entry.grid(row=3, column=4, sticky=tk.W, pady=5)
+
         self.show_video = tk.BooleanVar()
         self.show_video.set(self.tracking_config.show_video)
         self.show_video_checkbox = tk.Checkbutton(
             self.tracking_config_frame, text="Show video", variable=self.show_video)
         self.show_video_checkbox.grid(row=4, column=1, pady=5)
 
+        self.roi_detection = tk.BooleanVar()
+        self.roi_detection.set(self.tracking_config.roi_detection)
+        self.roi_detection_checkbox = tk.Checkbutton(
+            self.tracking_config_frame, text="ROI detection", variable=self.roi_detection)
+        self.roi_detection_checkbox.grid(row=5, column=1, pady=5)
+
+        self.detection_workers_frame = tk.Frame(self.tracking_config_frame)
+        self.detection_workers_frame.grid(row=6, column=1, pady=5)
+
+        self.detection_workers = tk.IntVar()
+        self.detection_workers.set(self.tracking_config.detection_workers)
+        self.detection_workers_label = ttk.Label(
+            self.detection_workers_frame, text="Detection workers:")
+        self.detection_workers_label.grid(row=1, column=1)
+        self.detection_workers_spinbox = tk.Spinbox(
+            self.detection_workers_frame, from_=1, to=multiprocessing.cpu_count(),
+            textvariable=self.detection_workers, width=5, state="readonly")
+        self.detection_workers_spinbox.grid(row=1, column=2)
+
+        self.preview_rate_frame = tk.Frame(self.tracking_config_frame)
+        self.preview_rate_frame.grid(row=8, column=1, pady=5)
+
+        self.preview_rate = tk.IntVar()
+        self.preview_rate.set(self.tracking_config.preview_rate)
+        self.preview_rate_label = ttk.Label(
+            self.preview_rate_frame, text="Preview rate (Hz):")
+        self.preview_rate_label.grid(row=1, column=1)
+        self.preview_rate_spinbox = tk.Spinbox(
+            self.preview_rate_frame, from_=1, to=60,
+            textvariable=self.preview_rate, width=5, state="readonly")
+        self.preview_rate_spinbox.grid(row=1, column=2)
+
+        self.detection_scale_frame = tk.Frame(self.tracking_config_frame)
+        self.detection_scale_frame.grid(row=9, column=1, pady=5)
+
+        self.detection_scale_label = ttk.Label(
+            self.detection_scale_frame, text="Detection scale:")
+        self.detection_scale_label.grid(row=1, column=1)
+        self.detection_scale = ttk.Combobox(
+            self.detection_scale_frame, state="readonly", width=6,
+            values=[name for name, _ in DETECTION_SCALES])
+        self.detection_scale.set(next(
+            (name for name, scale in DETECTION_SCALES if scale == self.tracking_config.detection_scale),
+            DETECTION_SCALES[0][0]))
+        self.detection_scale.grid(row=1, column=2)
+
+        self.capture_resolution_frame = tk.Frame(self.tracking_config_frame)
+        self.capture_resolution_frame.grid(row=11, column=1, pady=5)
+
+        self.capture_resolution_label = ttk.Label(
+            self.capture_resolution_frame, text="Capture resolution:")
+        self.capture_resolution_label.grid(row=1, column=1)
+        self.capture_resolution = ttk.Combobox(
+            self.capture_resolution_frame, state="readonly", width=10,
+            values=["{}x{}".format(width, height) for width, height in CAPTURE_RESOLUTIONS])
+        self.capture_resolution.set("{}x{}".format(*self.tracking_config.capture_resolution))
+        self.capture_resolution.grid(row=1, column=2)
+
+        self.capture_fourcc = ttk.Combobox(
+            self.capture_resolution_frame, state="readonly", width=8,
+            values=[name for name, _ in CAPTURE_FOURCCS])
+        self.capture_fourcc.set(next(
+            (name for name, fourcc in CAPTURE_FOURCCS if fourcc == self.tracking_config.capture_fourcc),
+            CAPTURE_FOURCCS[0][0]))
+        self.capture_fourcc.grid(row=1, column=3, padx=5)
+
+        self.capture_fps = tk.IntVar()
+        self.capture_fps.set(self.tracking_config.capture_fps)
+        self.capture_fps_label = ttk.Label(
+            self.capture_resolution_frame, text="FPS (0 default):")
+        self.capture_fps_label.grid(row=1, column=4)
+        self.capture_fps_entry = ttk.Entry(
+            self.capture_resolution_frame, textvariable=self.capture_fps, width=5)
+        self.capture_fps_entry.grid(row=1, column=5)
+
+        self.cube_board_pose = tk.BooleanVar()
+        self.cube_board_pose.set(self.tracking_config.cube_board_pose)
+        self.cube_board_pose_checkbox = tk.Checkbutton(
+            self.tracking_config_frame, text="Pose cubes from all visible faces", variable=self.cube_board_pose)
+        self.cube_board_pose_checkbox.grid(row=10, column=1, pady=5)
+
+        self.show_instrumentation = tk.BooleanVar()
+        self.show_instrumentation.set(self.tracking_config.show_instrumentation)
+        self.show_instrumentation_checkbox = tk.Checkbutton(
+            self.tracking_config_frame, text="Show stage timings", variable=self.show_instrumentation)
+        self.show_instrumentation_checkbox.grid(row=7, column=1, pady=5)
+
         self.tracking_button = tk.Button(
             window, text="Start Tracking", command=self.start_tracking)
-        self.tracking_button.grid(row=4, column=1, sticky=tk.S)
+        self.tracking_button.grid(row=2, column=1, pady=5)
 
         self.base_video_source_dir = '../assets/camera_calibration_data'
         self.base_cube_dir = '../assets/configs/marker_cubes'
@@ -353,9 +524,25 @@ class App():
         self.refresh_video_sources()
         self.video_source_init()
 
+    def settings_frame_resized(self, _event):
+        self.settings_canvas['scrollregion'] = self.settings_canvas.bbox(tk.ALL)
+
+    def settings_canvas_resized(self, event):
+        # The settings keep the width of the window, only their height scrolls.
+        self.settings_canvas.itemconfigure(
+            self.settings_frame_item, width=event.width)
+
+    def settings_scrolled(self, event):
+        if self.settings_frame.winfo_reqheight() > self.settings_canvas.winfo_height():
+            self.settings_canvas.yview_scroll(int(-event.delta / 120), tk.UNITS)
+
     def single_marker_settings_selection(self):
         if self.single_marker_mode.get():
             self.marker_cube_mode.set(False)
+            self.multi_target_mode.set(False)
+
+            for child in self.multi_target_settings_frame.winfo_children():
+                child.configure(state=tk.DISABLED)
 
             for child in self.single_marker_settings_frame.winfo_children():
                 child.configure(state=tk.ACTIVE)
@@ -388,6 +575,11 @@ class App():
     def marker_cube_settings_selection(self):
         if self.marker_cube_mode.get():
             self.single_marker_mode.set(False)
+            self.multi_target_mode.set(False)
+
+            for child in self.multi_target_settings_frame.winfo_children():
+                child.configure(state=tk.DISABLED)
+
             for child in self.marker_cube_settings_frame.winfo_children():
                 child.configure(state=tk.ACTIVE)
 
@@ -405,6 +597,59 @@ class App():
         else:
             self.marker_cube_mode.set(True)
 
+    def multi_target_settings_selection(self):
+        if self.multi_target_mode.get():
+            self.single_marker_mode.set(False)
+            self.marker_cube_mode.set(False)
+
+            for child in self.multi_target_settings_frame.winfo_children():
+                child.configure(state=tk.NORMAL)
+
+            for child in self.single_marker_settings_frame.winfo_children():
+                child.configure(state=tk.DISABLED)
+
+            for child in self.single_marker_buttons_frame.winfo_children():
+                child.configure(state=tk.DISABLED)
+
+            for child in self.marker_cube_settings_frame.winfo_children():
+                child.configure(state=tk.DISABLED)
+
+            for child in self.cube_id_frame.winfo_children():
+                child.configure(state=tk.DISABLED)
+
+            for child in self.marker_cube_buttons_frame.winfo_children():
+                child.configure(state=tk.DISABLED)
+        else:
+            self.multi_target_mode.set(True)
+
+    def multi_target_cubes_set(self, selected_cube_ids):
+        state = self.multi_target_cubes['state']
+        self.multi_target_cubes['state'] = tk.NORMAL
+
+        self.multi_target_cubes.delete(0, tk.END)
+        for cube_id in self.cube_ids:
+            if cube_id != "":
+                self.multi_target_cubes.insert(tk.END, cube_id)
+                if cube_id in selected_cube_ids:
+                    self.multi_target_cubes.selection_set(tk.END)
+
+        self.multi_target_cubes['state'] = state
+
+    def multi_target_selected_cube_ids(self):
+        return [self.multi_target_cubes.get(index) for index in self.multi_target_cubes.curselection()]
+
+    def multi_target_settings(self):
+        targets = []
+        if self.multi_target_single_marker.get():
+            targets.append((single_marker_target_name(
+                self.single_marker_settings), self.single_marker_settings))
+
+        for cube_id in self.multi_target_selected_cube_ids():
+            targets.append(
+                (cube_id, MarkersCubeDetectionSettings.persisted(cube_id)))
+
+        return MultiTargetDetectionSettings(targets)
+
     def cube_ids_init(self):
         for cube_id in os.listdir(self.base_cube_dir):
             self.cube_ids.append(cube_id.split(".")[0])
@@ -419,6 +664,12 @@ class App():
         else:
             self.cube_id_selection.set("")
 
+        selected_cube_ids = []
+        if self.tracking_config.marker_detection_settings is not None and \
+                self.tracking_config.marker_detection_settings.identifier == MULTI_DETECTION:
+            selected_cube_ids = self.tracking_config.marker_detection_settings.target_names
+        self.multi_target_cubes_set(selected_cube_ids)
+
     def cube_id_selected(self, _=None):
         self.marker_cube_settings = MarkersCubeDetectionSettings.persisted(
             self.cube_id_selection.get())
@@ -467,6 +718,7 @@ class App():
                 self.cube_ids.remove("")
 
             self.cube_id_selection['values'] = self.cube_ids
+            self.multi_target_cubes_set(self.multi_target_selected_cube_ids())
 
     def marker_cube_delete(self):
         filename = '../assets/configs/marker_cubes/{}.pkl'.format(
@@ -477,6 +729,7 @@ class App():
         if self.cube_ids.__contains__(self.cube_id_selection.get()):
             self.cube_ids.remove(self.cube_id_selection.get())
             self.cube_id_selection['values'] = self.cube_ids
+            self.multi_target_cubes_set(self.multi_target_selected_cube_ids())
 
         if len(self.cube_ids) > 0:
             self.cube_id_selection.current(0)
@@ -534,15 +787,7 @@ class App():
             self.calibration_status['foreground'] = "red"
 
     def check_video_source_calibration(self):
-        if not os.path.exists(self.get_video_source_dir()):
-            return False
-
-        cam_mtx_exists = os.path.isfile(
-            '{}/cam_mtx.npy'.format(self.get_video_source_dir()))
-        dist_exists = os.path.isfile(
-            '{}/dist.npy'.format(self.get_video_source_dir()))
-
-        return cam_mtx_exists & dist_exists
+        return calibration_registry.is_calibrated(self.get_video_source_dir())
 
     def get_video_source_dir(self):
         camera_identification = self.video_source.get().replace(" ", "_")
@@ -552,14 +797,31 @@ class App():
         self.tracking_config.device_number = self.video_source.current()
         self.tracking_config.device_parameters_dir = self.get_video_source_dir()
         self.tracking_config.show_video = self.show_video.get()
+        self.tracking_config.roi_detection = self.roi_detection.get()
+        self.tracking_config.show_instrumentation = self.show_instrumentation.get()
+        self.tracking_config.preview_rate = self.preview_rate.get()
+        self.tracking_config.detection_workers = self.detection_workers.get()
+        self.tracking_config.detection_scale = DETECTION_SCALES[self.detection_scale.current()][1]
+        self.tracking_config.cube_board_pose = self.cube_board_pose.get()
+        self.tracking_config.capture_resolution = tuple(
+            int(size) for size in self.capture_resolution.get().split('x'))
+        if self.capture_fourcc.current() != -1:
+            # Without a selection the configured fourcc is kept.
+            self.tracking_config.capture_fourcc = CAPTURE_FOURCCS[self.capture_fourcc.current()][1]
+        self.tracking_config.capture_fps = self.capture_fps.get()
         self.tracking_config.server_ip = self.server_ip.get()
         self.tracking_config.server_port = self.server_port.get()
+        self.tracking_config.wire_format = self.wire_format.get()
+        self.tracking_config.prediction_lead = self.prediction_lead.get() / 1000
+        self.tracking_config.output_rate = self.output_rate.get()
 
         marker_detection_settings = None
         if self.single_marker_mode.get():
             marker_detection_settings = self.single_marker_settings
         elif self.marker_cube_mode.get():
             marker_detection_settings = self.marker_cube_settings
+        elif self.multi_target_mode.get():
+            marker_detection_settings = self.multi_target_settings()
 
         self.tracking_config.marker_detection_settings = marker_detection_settings
 
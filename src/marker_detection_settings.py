@@ -4,13 +4,17 @@ except ModuleNotFoundError:
     import pickle
 
 import os
-import statistics
+import collections
 import cv2
 import numpy as np
 import cv2.aruco as aruco
+from calibration_registry import calibration_registry
+from detector_profile import DetectorProfile
+import geometry
 
 CUBE_DETECTION = "MARKERS CUBE"
 SINGLE_DETECTION = "SINGLE MARKER"
+MULTI_DETECTION = "MULTI TARGET"
 
 
 class SingleMarkerDetectionSettings():
@@ -82,9 +86,112 @@ class MarkersCubeDetectionSettings():
             return cls("", "", ["", "", "", ""], "", None)
 
 
+class MultiTargetDetectionSettings():
+
+    def __init__(self, targets):
+        self.identifier = MULTI_DETECTION
+        # List of (name, SingleMarkerDetectionSettings or MarkersCubeDetectionSettings).
+        self.targets = targets
+
+    @property
+    def target_names(self):
+        return [name for name, _ in self.targets]
+
+
+def single_marker_target_name(settings):
+    return "marker_{}".format(settings.marker_id)
+
+
+# Samples the estimate of a pair of markers is checked against for stability.
+STABILITY_WINDOW = 10
+
+
+def find_best_transformation(transformations, average_transformations=True):
+    # Every candidate other_to_target is scored by the mean squared error of all the entries of
+    # other . candidate against target, over every sample. The sum over the samples expands to
+    # sum |T|^2 - 2 <sum O^T T, C> + <sum O^T O, C C^T>, so the samples are summed once instead
+    # of once per candidate.
+    others = np.array([transformation["other"] for transformation in transformations])
+    targets = np.array([transformation["target"] for transformation in transformations])
+    candidates = np.array([transformation["other_to_target"] for transformation in transformations])
+
+    others_targets = np.einsum('nji,njk->ik', others, targets)
+    others_others = np.einsum('nji,njk->ik', others, others)
+    targets_norm = np.sum(targets ** 2)
+
+    def errors(candidates):
+        return (targets_norm - 2 * np.einsum('ij,nij->n', others_targets, candidates) +
+                np.einsum('ij,nik,njk->n', others_others, candidates, candidates)) / len(transformations)
+
+    candidate_errors = errors(candidates)
+    best = int(np.argmin(candidate_errors))
+    best_transformation, min_error = candidates[best], float(candidate_errors[best])
+
+    if average_transformations:
+        # The candidates scoring better than the median are averaged, which cancels their
+        # own measurement noise, the average is kept when it scores better.
+        inliers = candidates[candidate_errors <= np.median(candidate_errors)]
+        mean_transformation = geometry.mean_pose(inliers)
+        mean_error = float(errors(mean_transformation[None])[0])
+        if mean_error < min_error:
+            best_transformation, min_error = mean_transformation, mean_error
+
+    return best_transformation, min_error
+
+
+class TransformationEstimate:
+
+    def __init__(self, min_count, max_count, translation_tolerance, rotation_tolerance, average_transformations=True):
+        # Estimate of the transformation between two markers, updated with every sample. It is done
+        # once it moved less than the tolerances over the last samples, or at max_count samples.
+        self.__min_count = min_count
+        self.__max_count = max_count
+        self.__translation_tolerance = translation_tolerance
+        self.__rotation_tolerance = rotation_tolerance
+        self.__average_transformations = average_transformations
+
+        self.samples = []
+        self.transformation = None
+        self.error = None
+        # Translation and rotation (degrees) change of the estimate over the last samples.
+        self.translation_change = None
+        self.rotation_change = None
+        self.__history = collections.deque(maxlen=STABILITY_WINDOW + 1)
+
+    @property
+    def count(self):
+        return len(self.samples)
+
+    @property
+    def stable(self):
+        return self.translation_change is not None and \
+            self.translation_change <= self.__translation_tolerance and \
+            self.rotation_change <= self.__rotation_tolerance
+
+    @property
+    def done(self):
+        return self.count >= self.__max_count or (self.count >= self.__min_count and self.stable)
+
+    def add(self, sample):
+        self.samples.append(sample)
+        self.transformation, self.error = find_best_transformation(
+            self.samples, self.__average_transformations)
+
+        self.__history.append(self.transformation)
+        if len(self.__history) == self.__history.maxlen:
+            oldest = self.__history[0]
+            self.translation_change = float(np.linalg.norm(
+                self.transformation[:3, 3] - oldest[:3, 3]))
+            relative_rotation = np.dot(oldest[:3, :3].T, self.transformation[:3, :3])
+            self.rotation_change = float(np.degrees(np.arccos(
+                np.clip((np.trace(relative_rotation) - 1) / 2, -1.0, 1.0))))
+
+
 class MarkerCubeMapping:
 
-    def __init__(self, cube_id, video_source_dir, video_source, markers_length, up_marker_id, side_marker_ids, down_marker_id):
+    def __init__(self, cube_id, video_source_dir, video_source, markers_length, up_marker_id, side_marker_ids, down_marker_id,
+                 acquire_min_count=20, acquire_max_count=300, translation_tolerance=0.02, rotation_tolerance=0.1,
+                 average_transformations=True):
         self.__cube_id = cube_id
         self.__video_source_dir = video_source_dir
         self.__video_source = video_source
@@ -102,7 +209,15 @@ class MarkerCubeMapping:
         else:
             self.__down_marker_id = down_marker_id
 
-        self.__acquire_min_count = 100
+        # Each pair of markers is sampled until its estimate is stable to the tolerances, in the
+        # markers length unit and degrees, with at least acquire_min_count samples and at most acquire_max_count.
+        self.__acquire_min_count = acquire_min_count
+        self.__acquire_max_count = acquire_max_count
+        self.__translation_tolerance = translation_tolerance
+        self.__rotation_tolerance = rotation_tolerance
+        self.__average_transformations = average_transformations
+        # The markers are detected with the settings tuned for the camera, as when tracking.
+        self.__detector_profile = DetectorProfile.persisted(video_source_dir)
 
     def map(self):
         side_up_transformations = {}
@@ -110,14 +225,9 @@ class MarkerCubeMapping:
             down_side_transformations = {}
         for side_marker_id in self.__side_marker_ids:
             if side_marker_id != "":
-                side_up_transformations[side_marker_id] = []
+                side_up_transformations[side_marker_id] = self.__transformation_estimate()
                 if self.__down_marker_id != "":
-                    down_side_transformations[side_marker_id] = []
-
-        cam_mtx = np.load(
-            "{}/cam_mtx.npy".format(self.__video_source_dir))
-        dist = np.load(
-            "{}/dist.npy".format(self.__video_source_dir))
+                    down_side_transformations[side_marker_id] = self.__transformation_estimate()
 
         win_name = "Markers Cube Calibration Image Capture"
         cv2.namedWindow(win_name, cv2.WND_PROP_FULLSCREEN)
@@ -130,18 +240,20 @@ class MarkerCubeMapping:
         video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
         video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
 
+        cam_mtx, dist = calibration_registry.camera_parameters(
+            self.__video_source_dir, (int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                      int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))))
+
         while True:
             _, frame = video_capture.read()
 
             done = True
             for side_marker_id in self.__side_marker_ids:
                 if side_marker_id != "":
-                    done &= len(
-                        side_up_transformations[side_marker_id]) == self.__acquire_min_count
-                    
+                    done &= side_up_transformations[side_marker_id].done
+
                     if self.__down_marker_id != "":
-                        done &= len(
-                            down_side_transformations[side_marker_id]) == self.__acquire_min_count
+                        done &= down_side_transformations[side_marker_id].done
 
             if not done:
                 corners, ids = self.__detect_markers(frame)
@@ -155,6 +267,8 @@ class MarkerCubeMapping:
                 if np.all(ids is not None):
                     rvecs, tvecs, _ = aruco.estimatePoseSingleMarkers(
                         corners, float(self.__markers_length), cam_mtx, dist)
+                    marker_transformations = geometry.pose_matrices(
+                        rvecs, tvecs)
 
                     up_marker_index = None
                     down_marker_index = None
@@ -188,25 +302,25 @@ class MarkerCubeMapping:
                         cv2.putText(frame, "marker {} -> marker {} mapping".format(
                             ids[other_marker_index][0], ids[target_marker_index][0]), (0, 20), font, scale, blue, 2, cv2.LINE_AA)
 
-                        acquired_transformations_count = len(
-                            transformation_destination[ids[destination_index][0]])
-                        if acquired_transformations_count < self.__acquire_min_count:
-                            cv2.putText(frame, "Count: {}".format(
-                                acquired_transformations_count), (0, 40), font, scale, red, 2, cv2.LINE_AA)
+                        estimate = transformation_destination[ids[destination_index][0]]
+                        if not estimate.done:
+                            cv2.putText(frame, "Count: {}/{}".format(
+                                estimate.count, self.__acquire_max_count), (0, 40), font, scale, red, 2, cv2.LINE_AA)
+                            if estimate.translation_change is not None:
+                                cv2.putText(frame, "Residual: {:.4f} Change: {:.3f} {:.2f} deg".format(
+                                    estimate.error, estimate.translation_change, estimate.rotation_change),
+                                    (0, 90), font, scale, red, 2, cv2.LINE_AA)
 
-                            target_marker_transformation = self.__get_transformation_matrix(
-                                rvecs[target_marker_index], tvecs[target_marker_index])
-                            other_marker_transformation = self.__get_transformation_matrix(
-                                rvecs[other_marker_index], tvecs[other_marker_index])
-                            transformation_other_to_target = np.dot(np.linalg.inv(
-                                other_marker_transformation), target_marker_transformation)
+                            target_marker_transformation = marker_transformations[target_marker_index]
+                            other_marker_transformation = marker_transformations[other_marker_index]
+                            transformation_other_to_target = np.dot(geometry.rigid_inverse(
+                                other_marker_transformation)[0], target_marker_transformation)
 
                             acquire = {}
                             acquire["target"] = target_marker_transformation
                             acquire["other"] = other_marker_transformation
                             acquire["other_to_target"] = transformation_other_to_target
-                            transformation_destination[ids[destination_index][0]].append(
-                                acquire)
+                            estimate.add(acquire)
 
                         else:
                             cv2.putText(frame, "Done!", (0, 40),
@@ -247,9 +361,7 @@ class MarkerCubeMapping:
                 break
 
     def __detect_markers(self, frame):
-        parameters = aruco.DetectorParameters_create()
-        parameters.adaptiveThreshConstant = 7
-        parameters.cornerRefinementMethod = aruco.CORNER_REFINE_CONTOUR
+        parameters = self.__detector_profile.detector_parameters()
 
         corners, ids, _ = aruco.detectMarkers(
             cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
@@ -260,36 +372,22 @@ class MarkerCubeMapping:
 
         return corners, ids
 
-    def __get_transformation_matrix(self, rvec, tvec):
-        rot_mtx = np.zeros(shape=(3, 3))
-        cv2.Rodrigues(rvec, rot_mtx)
-
-        transformation = np.concatenate(
-            (rot_mtx, np.transpose(tvec)), axis=1)
-        transformation = np.concatenate(
-            (transformation, np.array([[0, 0, 0, 1]])))
-
-        return transformation
-
     def __compute_transformations(self, side_up_transformations, down_side_transformations=None):
         transformations = {}
         side_up_transformation_errors = {}
 
         for side_marker_id in self.__side_marker_ids:
             if side_marker_id != "":
-                best_transformation, error = self.__find_best_transformation(
-                    side_up_transformations[side_marker_id])
-
-                transformations[side_marker_id] = best_transformation
-                side_up_transformation_errors[side_marker_id] = error
+                transformations[side_marker_id] = side_up_transformations[side_marker_id].transformation
+                side_up_transformation_errors[side_marker_id] = side_up_transformations[side_marker_id].error
 
         best_down_up_transformation = np.zeros(shape=(4, 4))
         min_error = None
         if down_side_transformations is not None:
             for side_marker_id in self.__side_marker_ids:
                 if side_marker_id != "":
-                    best_down_side_transformation, error = self.__find_best_transformation(
-                        down_side_transformations[side_marker_id])
+                    best_down_side_transformation = down_side_transformations[side_marker_id].transformation
+                    error = down_side_transformations[side_marker_id].error
 
                     if min_error is None or min_error > side_up_transformation_errors[side_marker_id] + error:
                         best_down_up_transformation = np.dot(
@@ -300,28 +398,6 @@ class MarkerCubeMapping:
 
         return transformations
 
-    def __find_best_transformation(self, transformations):
-        best_transformation = np.zeros(shape=(4, 4))
-        rows_count, cols_count = best_transformation.shape
-        min_error = None
-
-        for testing_transformation in transformations:
-            local_errors = []
-            for transformation in transformations:
-                local_error = 0
-                calculated_result = np.dot(
-                    transformation["other"], testing_transformation["other_to_target"])
-
-                for row in range(0, rows_count):
-                    for col in range(0, cols_count):
-                        local_error += (transformation["target"][row][col] -
-                                        calculated_result[row][col])**2
-
-                local_errors.append(local_error)
-
-            local_errors_mean = statistics.mean(local_errors)
-            if min_error is None or min_error > local_errors_mean:
-                best_transformation = testing_transformation["other_to_target"]
-                min_error = local_errors_mean
-
-        return best_transformation, min_error
+    def __transformation_estimate(self):
+        return TransformationEstimate(self.__acquire_min_count, self.__acquire_max_count, self.__translation_tolerance,
+                                      self.__rotation_tolerance, self.__average_transformations)
@@ -0,0 +1,286 @@
+import time
+import numpy as np
+import cv2
+import cv2.aruco as aruco
+from marker_detection_settings import SINGLE_DETECTION, CUBE_DETECTION, MULTI_DETECTION, single_marker_target_name
+from calibration_registry import calibration_registry
+from detector_profile import DetectorProfile
+import geometry
+
+# Markers found on a downscaled image are detected again on a full resolution crop around them,
+# grown by this fraction of their size on each side.
+REFINEMENT_CROP_MARGIN = 0.25
+
+# Board poses seeded with the previous pose are solved again from scratch above this mean
+# reprojection error in pixels, the seed was too far from the actual pose.
+MAX_BOARD_REPROJECTION_ERROR = 2.0
+
+
+def marker_object_points(marker_length):
+    # Same corner order and axes as estimatePoseSingleMarkers.
+    half_length = marker_length / 2
+
+    return np.array([[-half_length, half_length, 0], [half_length, half_length, 0],
+                     [half_length, -half_length, 0], [-half_length, -half_length, 0]])
+
+
+class MarkerPoseEstimation:
+
+    def __init__(self, target_poses, corners, ids, target_corners, timings=None):
+        # 4x4 pose of each target, None when the target was not found.
+        self.target_poses = target_poses
+        self.corners = corners
+        self.ids = ids
+        # Corners of the tracked markers, used to search the next frame.
+        self.target_corners = target_corners
+        # Seconds spent in each stage, measured where the estimation ran, possibly in a worker.
+        self.timings = timings if timings is not None else {}
+
+    @property
+    def success(self):
+        return any(target_pose is not None for target_pose in self.target_poses)
+
+
+class MarkerPoseEstimator:
+
+    def __init__(self, device_parameters_dir, marker_detection_settings, translation_offset, detector_profile=None,
+                 cube_board_pose=True):
+        self.__device_parameters_dir = device_parameters_dir
+        self.__translation_offset = translation_offset
+        # Detector settings tuned for the camera, saved next to its calibration.
+        if detector_profile is None:
+            detector_profile = DetectorProfile.persisted(device_parameters_dir)
+        self.__detector_profile = detector_profile
+
+        self.__targets = detection_targets(marker_detection_settings)
+
+        # Marker id -> (target index, marker length, transformation from the marker to the target pose).
+        # Cube face transformations and the translation offset are composed once here, so each
+        # frame only needs one batched product.
+        self.__marker_targets = {}
+        for target_index, (_, settings) in enumerate(self.__targets):
+            if settings.identifier == SINGLE_DETECTION:
+                self.__marker_targets[int(settings.marker_id)] = (
+                    target_index, float(settings.marker_length), np.array(translation_offset, dtype=np.float64))
+            elif settings.identifier == CUBE_DETECTION:
+                self.__marker_targets[int(settings.up_marker_id)] = (
+                    target_index, float(settings.markers_length), np.array(translation_offset, dtype=np.float64))
+
+                for marker_id in list(settings.side_marker_ids) + [settings.down_marker_id]:
+                    if marker_id != "" and settings.transformations is not None and marker_id in settings.transformations:
+                        self.__marker_targets[int(marker_id)] = (
+                            target_index, float(settings.markers_length),
+                            np.dot(settings.transformations[marker_id], translation_offset))
+            else:
+                raise Exception("Invalid target detection identifier. Received: {}".format(
+                    settings.identifier))
+
+        # Target index -> (marker id -> corners of the marker in the cube frame). The faces of a
+        # cube are one rigid board, its pose is solved once from the corners of every visible face.
+        self.__boards = {}
+        # Target index -> (rvec, tvec) of the last board pose, the seed of the next solve.
+        self.__board_poses = {}
+        if cube_board_pose:
+            for marker_id, (target_index, marker_length, _) in self.__marker_targets.items():
+                settings = self.__targets[target_index][1]
+                if settings.identifier != CUBE_DETECTION:
+                    continue
+
+                cube_marker_pose = np.eye(4)
+                if marker_id != int(settings.up_marker_id):
+                    cube_marker_pose = geometry.rigid_inverse(settings.transformations[marker_id])[0]
+
+                self.__boards.setdefault(target_index, {})[marker_id] = \
+                    np.dot(marker_object_points(marker_length), cube_marker_pose[:3, :3].T) + cube_marker_pose[:3, 3]
+
+    @property
+    def target_names(self):
+        return [name for name, _ in self.__targets]
+
+    def empty_estimation(self):
+        return MarkerPoseEstimation([None] * len(self.__targets), [], None, None)
+
+    def estimate(self, frame, region=None, scale=1.0):
+        timings = {}
+        corners, ids = self.__detect_markers(frame, region, scale, timings)
+
+        target_poses = [None] * len(self.__targets)
+        if ids is None:
+            return MarkerPoseEstimation(target_poses, corners, ids, None, timings)
+
+        marker_indexes = [i for i in range(0, ids.size)
+                          if int(ids[i][0]) in self.__marker_targets]
+        if len(marker_indexes) == 0:
+            return MarkerPoseEstimation(target_poses, corners, ids, None, timings)
+
+        start = time.perf_counter()
+
+        target_corners = [corners[i] for i in marker_indexes]
+        cam_mtx, dist = self.camera_parameters((frame.shape[1], frame.shape[0]))
+
+        for target_index, board in self.__boards.items():
+            board_indexes = [i for i in marker_indexes if int(ids[i][0]) in board]
+            if len(board_indexes) > 0:
+                target_poses[target_index] = self.__board_pose(
+                    target_index, [corners[i] for i in board_indexes],
+                    [int(ids[i][0]) for i in board_indexes], cam_mtx, dist)
+            else:
+                self.__board_poses.pop(target_index, None)
+
+        marker_indexes = [i for i in marker_indexes
+                          if self.__marker_targets[int(ids[i][0])][0] not in self.__boards]
+        if len(marker_indexes) == 0:
+            timings['estimate_pose'] = time.perf_counter() - start
+            return MarkerPoseEstimation(target_poses, corners, ids, target_corners, timings)
+
+        marker_targets = [self.__marker_targets[int(ids[i][0])]
+                          for i in marker_indexes]
+
+        # One batch for every marker of every other target. Poses are estimated for unit length
+        # markers, the rotation does not depend on the length and the translation scales with it.
+        rvecs, tvecs, _ = aruco.estimatePoseSingleMarkers(
+            [corners[i] for i in marker_indexes], 1.0, cam_mtx, dist)
+
+        tvecs = np.reshape(tvecs, (-1, 3)) * \
+            np.array([marker_length for _, marker_length, _ in marker_targets])[:, None]
+
+        positions = geometry.compose(
+            geometry.pose_matrices(rvecs, tvecs),
+            np.array([transformation for _, _, transformation in marker_targets]))
+
+        # A single marker target uses its first detection, a cube its nearest face,
+        # which gives the most reliable pose.
+        choosen_markers = {}
+        for marker, (target_index, _, _) in enumerate(marker_targets):
+            choosen_marker = choosen_markers.get(target_index)
+            if choosen_marker is None:
+                choosen_markers[target_index] = marker
+            elif self.__targets[target_index][1].identifier == CUBE_DETECTION and \
+                    tvecs[choosen_marker, 2] > tvecs[marker, 2]:
+                choosen_markers[target_index] = marker
+
+        for target_index, marker in choosen_markers.items():
+            target_poses[target_index] = positions[marker]
+
+        timings['estimate_pose'] = time.perf_counter() - start
+
+        return MarkerPoseEstimation(target_poses, corners, ids, target_corners, timings)
+
+    def camera_parameters(self, resolution=None):
+        # The intrinsics are rescaled when the frames are not at the calibration resolution.
+        return calibration_registry.camera_parameters(self.__device_parameters_dir, resolution)
+
+    def __board_pose(self, target_index, board_corners, board_ids, cam_mtx, dist):
+        board = self.__boards[target_index]
+        object_points = np.concatenate([board[marker_id] for marker_id in board_ids])
+        image_points = np.concatenate(board_corners).reshape(-1, 2).astype(np.float64)
+
+        solved = False
+        previous_pose = self.__board_poses.get(target_index)
+        if previous_pose is not None:
+            # The previous pose is close, the solve converges in a few iterations and does
+            # not flip between the ambiguous poses of a single face.
+            rvec, tvec = previous_pose[0].copy(), previous_pose[1].copy()
+            solved, rvec, tvec = cv2.solvePnP(
+                object_points, image_points, cam_mtx, dist, rvec, tvec, True, cv2.SOLVEPNP_ITERATIVE)
+            solved = solved and reprojection_error(
+                object_points, image_points, rvec, tvec, cam_mtx, dist) <= MAX_BOARD_REPROJECTION_ERROR
+
+        if not solved:
+            solved, rvec, tvec = cv2.solvePnP(
+                object_points, image_points, cam_mtx, dist, flags=cv2.SOLVEPNP_ITERATIVE)
+
+        if not solved:
+            self.__board_poses.pop(target_index, None)
+            return None
+
+        self.__board_poses[target_index] = (rvec, tvec)
+
+        return np.dot(geometry.pose_matrices(rvec, tvec)[0], self.__translation_offset)
+
+    def __detect_markers(self, frame, region, scale, timings):
+        parameters = self.__detector_profile.detector_parameters()
+
+        if region is None:
+            search_image = frame
+        else:
+            x_min, y_min, x_max, y_max = region
+            search_image = frame[y_min:y_max, x_min:x_max]
+
+        start = time.perf_counter()
+        gray = cv2.cvtColor(search_image, cv2.COLOR_BGR2GRAY)
+        converted = time.perf_counter()
+
+        if scale >= 1.0:
+            corners, ids, _ = aruco.detectMarkers(
+                gray, aruco.Dictionary_get(aruco.DICT_6X6_250), parameters=parameters)
+        else:
+            corners, ids = self.__detect_markers_downscaled(gray, scale, parameters, timings)
+
+        timings['cvt_color'] = converted - start
+        timings['detect_markers'] = time.perf_counter() - converted
+
+        if region is not None:
+            offset = np.array([x_min, y_min], dtype=np.float32)
+            corners = [marker_corners + offset for marker_corners in corners]
+
+        return corners, ids
+
+    def __detect_markers_downscaled(self, gray, scale, parameters, timings):
+        # The downscaled image only locates the markers, their corners come from the full
+        # resolution image, so the pose keeps the full resolution accuracy.
+        dictionary = aruco.Dictionary_get(aruco.DICT_6X6_250)
+        small_gray = cv2.resize(gray, None, fx=scale, fy=scale,
+                                interpolation=cv2.INTER_AREA)
+        coarse_corners, coarse_ids, _ = aruco.detectMarkers(
+            small_gray, dictionary, parameters=parameters)
+
+        if coarse_ids is None or len(coarse_corners) == 0:
+            return coarse_corners, coarse_ids
+
+        start = time.perf_counter()
+        height, width = gray.shape[:2]
+        corners = []
+        for marker_corners, marker_id in zip(coarse_corners, coarse_ids):
+            # Pixel centers are at +0.5, so the corners are scaled around them.
+            marker_corners = (marker_corners + 0.5) / scale - 0.5
+
+            points = marker_corners.reshape(4, 2)
+            margin = (points.max(axis=0) - points.min(axis=0)).max() * REFINEMENT_CROP_MARGIN + 2 / scale
+            x_min, y_min = np.maximum(np.floor(points.min(axis=0) - margin).astype(int), 0)
+            x_max, y_max = np.minimum(np.ceil(points.max(axis=0) + margin).astype(int) + 1, [width, height])
+
+            fine_corners, fine_ids, _ = aruco.detectMarkers(
+                gray[y_min:y_max, x_min:x_max], dictionary, parameters=parameters)
+
+            # The upscaled corners are kept when the marker is not found again.
+            if fine_ids is not None:
+                for candidate_corners, candidate_id in zip(fine_corners, fine_ids):
+                    if candidate_id[0] == marker_id[0]:
+                        marker_corners = candidate_corners + np.array([x_min, y_min], dtype=np.float32)
+                        break
+
+            corners.append(marker_corners.astype(np.float32))
+
+        timings['refine_corners'] = time.perf_counter() - start
+
+        return corners, coarse_ids
+
+
+def detection_targets(marker_detection_settings):
+    # (name, settings) of each tracked target.
+    if marker_detection_settings.identifier == SINGLE_DETECTION:
+        return [(single_marker_target_name(marker_detection_settings), marker_detection_settings)]
+    if marker_detection_settings.identifier == CUBE_DETECTION:
+        return [("cube", marker_detection_settings)]
+    if marker_detection_settings.identifier == MULTI_DETECTION:
+        return list(marker_detection_settings.targets)
+
+    raise Exception("Invalid detection identifier. Received: {}".format(
+        marker_detection_settings.identifier))
+
+
+def reprojection_error(object_points, image_points, rvec, tvec, cam_mtx, dist):
+    projected_points, _ = cv2.projectPoints(object_points, rvec, tvec, cam_mtx, dist)
+
+    return float(np.linalg.norm(projected_points.reshape(-1, 2) - image_points, axis=1).mean())
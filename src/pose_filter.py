@@ -0,0 +1,138 @@
+import collections
+import math
+import numpy as np
+import geometry
+
+# Snapshot of a filter, enough to extrapolate the pose in another process.
+PoseState = collections.namedtuple(
+    'PoseState', ['timestamp', 'translation_states', 'rotation_states'])
+
+
+def transition_matrix(time_step, order):
+    transition = np.eye(order)
+    for row in range(0, order):
+        for column in range(row + 1, order):
+            transition[row, column] = time_step ** (column - row) / \
+                math.factorial(column - row)
+
+    return transition
+
+
+def shared_covariance_kalman_step(states, covariance, transition, process_noise, measurement_noise, measurements):
+    # Every row of states is an independent component (an axis, a quaternion component) with
+    # the same model and noise, so all of them share one covariance and one gain.
+    states = np.matmul(states, transition.T)
+    covariance = np.matmul(np.matmul(transition, covariance),
+                           transition.T) + process_noise
+
+    gain = covariance[:, 0] / (covariance[0, 0] + measurement_noise)
+    states = states + np.outer(measurements - states[:, 0], gain)
+    covariance = covariance - np.outer(gain, covariance[0, :])
+
+    return states, covariance
+
+
+def predict_pose(pose_state, timestamp):
+    # Constant acceleration translation and constant rate quaternion extrapolated to timestamp.
+    time_step = max(timestamp - pose_state.timestamp, 0.0)
+
+    translation = np.dot(pose_state.translation_states,
+                         transition_matrix(time_step, 3)[0])
+    quaternion = np.dot(pose_state.rotation_states,
+                        transition_matrix(time_step, 2)[0])
+
+    return translation, geometry.quaternions_to_rotation_matrices(quaternion)[0]
+
+
+class PoseFilter:
+
+    def __init__(self, translation_process_noise=1e-5, translation_measurement_noise=1e-4,
+                 rotation_process_noise=1e-4, rotation_measurement_noise=1e-4,
+                 nominal_time_step=0.0334, reset_time=0.5):
+        self.__translation_process_noise = translation_process_noise
+        self.__translation_measurement_noise = translation_measurement_noise
+        self.__rotation_process_noise = rotation_process_noise
+        self.__rotation_measurement_noise = rotation_measurement_noise
+        self.__nominal_time_step = nominal_time_step
+        self.__reset_time = reset_time
+
+        self.timestamp = None
+        # Position, velocity and acceleration of each axis.
+        self.__translation_states = np.zeros((3, 3))
+        self.__translation_covariance = np.eye(3)
+        # Value and rate of each quaternion component (w, x, y, z).
+        self.__rotation_states = np.zeros((4, 2))
+        self.__rotation_covariance = np.eye(2)
+
+    @property
+    def initialized(self):
+        return self.timestamp is not None
+
+    @property
+    def translation(self):
+        return self.__translation_states[:, 0].copy()
+
+    @property
+    def rotation_matrix(self):
+        return geometry.quaternions_to_rotation_matrices(self.__rotation_states[:, 0])[0]
+
+    def update(self, timestamp, translation, rotation_matrix):
+        translation = np.reshape(translation, (3,)).astype(np.float64)
+        quaternion = geometry.rotation_matrices_to_quaternions(rotation_matrix)[0]
+
+        if self.timestamp is None or not 0 < timestamp - self.timestamp <= self.__reset_time:
+            self.__initialize(timestamp, translation, quaternion)
+            return
+
+        time_step = timestamp - self.timestamp
+        noise_scale = time_step / self.__nominal_time_step
+
+        self.__translation_states, self.__translation_covariance = shared_covariance_kalman_step(
+            self.__translation_states, self.__translation_covariance, transition_matrix(
+                time_step, 3),
+            np.eye(3) * self.__translation_process_noise * noise_scale,
+            self.__translation_measurement_noise, translation)
+
+        # q and -q are the same rotation, the measurement is taken on the state's side.
+        if np.dot(quaternion, self.__rotation_states[:, 0]) < 0:
+            quaternion = -quaternion
+
+        self.__rotation_states, self.__rotation_covariance = shared_covariance_kalman_step(
+            self.__rotation_states, self.__rotation_covariance, transition_matrix(
+                time_step, 2),
+            np.eye(2) * self.__rotation_process_noise * noise_scale,
+            self.__rotation_measurement_noise, quaternion)
+        self.__normalize_rotation()
+
+        self.timestamp = timestamp
+
+    def state(self):
+        if self.timestamp is None:
+            return None
+
+        return PoseState(self.timestamp, self.__translation_states.copy(), self.__rotation_states.copy())
+
+    def predict_translation(self, timestamp):
+        time_step = max(timestamp - self.timestamp, 0.0)
+
+        return np.dot(self.__translation_states, transition_matrix(time_step, 3)[0])
+
+    def __initialize(self, timestamp, translation, quaternion):
+        self.__translation_states = np.zeros((3, 3))
+        self.__translation_states[:, 0] = translation
+        self.__translation_covariance = np.diag(
+            [self.__translation_measurement_noise, 1.0, 1.0])
+
+        self.__rotation_states = np.zeros((4, 2))
+        self.__rotation_states[:, 0] = quaternion
+        self.__rotation_covariance = np.diag(
+            [self.__rotation_measurement_noise, 1.0])
+
+        self.timestamp = timestamp
+
+    def __normalize_rotation(self):
+        norm = np.linalg.norm(self.__rotation_states[:, 0])
+        self.__rotation_states[:, 0] /= norm
+        # The rate stays tangent to the unit sphere.
+        self.__rotation_states[:, 1] -= np.dot(
+            self.__rotation_states[:, 1], self.__rotation_states[:, 0]) * self.__rotation_states[:, 0]
@@ -0,0 +1,143 @@
+import platform
+import time
+from contextlib import nullcontext
+from multiprocessing import shared_memory, BoundedSemaphore, Lock
+import numpy as np
+
+# Largest UDP datagram, anything larger could not be sent anyway.
+MAX_MESSAGE_SIZE = 65507
+# Header: version, message length, followed by the message timestamp and the message.
+HEADER_FIELDS = 2
+# The seqlock relies on the stores reaching the other processes in program order, which only
+# x86 guarantees. Elsewhere the message is written and copied under a lock.
+X86_MACHINES = ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+
+
+class PoseMailbox:
+
+    def __init__(self, memory, wakeup, lock, owner):
+        # Holds only the latest message. A single writer never blocks, readers copy the message
+        # and retry when it changed while being copied (a seqlock). The version is odd while
+        # the message is being written.
+        self.__memory = memory
+        self.__wakeup = wakeup
+        self.__lock = lock
+        self.__owner = owner
+        self.__received_version = 0
+
+        self.__header = np.ndarray(
+            (HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf)
+        self.__timestamp = np.ndarray(
+            (1,), dtype=np.float64, buffer=memory.buf, offset=HEADER_FIELDS * 8)
+        self.__message = np.ndarray(
+            (memory.size - (HEADER_FIELDS + 1) * 8,), dtype=np.uint8, buffer=memory.buf,
+            offset=(HEADER_FIELDS + 1) * 8)
+
+        self.capacity = self.__message.size
+
+    @classmethod
+    def create(cls, name, capacity=MAX_MESSAGE_SIZE):
+        size = (HEADER_FIELDS + 1) * 8 + capacity
+
+        try:
+            memory = shared_memory.SharedMemory(
+                name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a tracking process that was terminated.
+            stale_memory = shared_memory.SharedMemory(name=name)
+            stale_memory.close()
+            stale_memory.unlink()
+            memory = shared_memory.SharedMemory(
+                name=name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf)
+        header[:] = 0
+        del header
+
+        # Released once per unread message at most, so the writer never waits on it.
+        lock = None if platform.machine().lower() in X86_MACHINES else Lock()
+
+        return cls(memory, BoundedSemaphore(1), lock, True)
+
+    @classmethod
+    def attach(cls, name, wakeup, lock):
+        # Only processes started by the app attach, and on POSIX they share the resource tracker
+        # of the owner. Their registration is the owner's one, so it is kept, and the owner unlinks
+        # the segment itself.
+        memory = shared_memory.SharedMemory(name=name)
+
+        return cls(memory, wakeup, lock, False)
+
+    @property
+    def name(self):
+        return self.__memory.name
+
+    def __reduce__(self):
+        # The semaphore and the lock can only be handed to processes while they are being started.
+        return (PoseMailbox.attach, (self.__memory.name, self.__wakeup, self.__lock))
+
+    def publish(self, message, timestamp):
+        if len(message) > self.capacity:
+            raise ValueError("Message larger than the mailbox. Received: {} bytes".format(len(message)))
+
+        # CPython does not reorder these stores and x86 keeps their order, readers see the odd
+        # version first.
+        with self.__locked():
+            version = int(self.__header[0])
+            self.__header[0] = version + 1
+            self.__timestamp[0] = timestamp
+            self.__header[1] = len(message)
+            self.__message[:len(message)] = np.frombuffer(message, dtype=np.uint8)
+            self.__header[0] = version + 2
+
+        try:
+            self.__wakeup.release()
+        except ValueError:
+            # The reader was already woken up for an unread message, it will read this one.
+            pass
+
+    def latest(self):
+        # (version, timestamp, message) of the latest message, None before the first one.
+        while True:
+            with self.__locked():
+                version = int(self.__header[0])
+                if version == 0:
+                    return None
+
+                if version % 2 == 0:
+                    timestamp = float(self.__timestamp[0])
+                    message = self.__message[:int(self.__header[1])].tobytes()
+
+                    if int(self.__header[0]) == version:
+                        return version, timestamp, message
+
+            time.sleep(0)
+
+    def receive(self, timeout=None):
+        # Waits for a message newer than the last one received and returns its (timestamp, message),
+        # or None after timeout seconds. Messages published in between are skipped.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            latest = self.latest()
+            if latest is not None and latest[0] != self.__received_version:
+                self.__received_version = latest[0]
+                return latest[1], latest[2]
+
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+
+            self.__wakeup.acquire(True, remaining)
+
+    def __locked(self):
+        return nullcontext() if self.__lock is None else self.__lock
+
+    def close(self):
+        del self.__header
+        del self.__timestamp
+        del self.__message
+
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
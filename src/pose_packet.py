@@ -0,0 +1,130 @@
+import struct
+
+JSON_FORMAT = "JSON"
+BINARY_FORMAT = "BINARY"
+
+POSE_PACKET_MAGIC = b'ARTP'
+POSE_PACKET_VERSION = 2
+
+FLAG_SUCCESS = 0x01
+FLAG_DOUBLE_PRECISION = 0x02
+FLAG_MULTI_TARGET = 0x04
+
+POSE_FIELDS = ('translation_x', 'translation_y', 'translation_z',
+               'rotation_right_x', 'rotation_right_y', 'rotation_right_z',
+               'rotation_up_x', 'rotation_up_y', 'rotation_up_z',
+               'rotation_forward_x', 'rotation_forward_y', 'rotation_forward_z')
+
+# magic, version, flags, pose fields count (targets count for multi target packets), sequence,
+# capture, processed and sent timestamps
+HEADER = struct.Struct('<4sBBHIddd')
+# The sent timestamp ends the header, it is written once the packet is about to be sent.
+SENT_TIMESTAMP = struct.Struct('<d')
+SENT_TIMESTAMP_OFFSET = HEADER.size - SENT_TIMESTAMP.size
+# Each target of a multi target packet: target index, flags, followed by the pose when found.
+TARGET_HEADER = struct.Struct('<HB')
+SINGLE_PRECISION_POSE = struct.Struct('<{}f'.format(len(POSE_FIELDS)))
+DOUBLE_PRECISION_POSE = struct.Struct('<{}d'.format(len(POSE_FIELDS)))
+
+
+def encode_pose_packet(detection_result, sequence, double_precision=False):
+    flags = 0
+    if double_precision:
+        flags |= FLAG_DOUBLE_PRECISION
+
+    if 'targets' in detection_result:
+        return encode_multi_target_pose_packet(detection_result, sequence, flags)
+
+    if not detection_result['success']:
+        return HEADER.pack(POSE_PACKET_MAGIC, POSE_PACKET_VERSION, flags, 0,
+                           sequence & 0xFFFFFFFF, *packet_timestamps(detection_result))
+
+    flags |= FLAG_SUCCESS
+    pose = DOUBLE_PRECISION_POSE if double_precision else SINGLE_PRECISION_POSE
+
+    return HEADER.pack(POSE_PACKET_MAGIC, POSE_PACKET_VERSION, flags, len(POSE_FIELDS),
+                       sequence & 0xFFFFFFFF, *packet_timestamps(detection_result)) + \
+        pose.pack(*[detection_result[field] for field in POSE_FIELDS])
+
+
+def encode_multi_target_pose_packet(detection_result, sequence, flags):
+    flags |= FLAG_MULTI_TARGET
+    if detection_result['success']:
+        flags |= FLAG_SUCCESS
+
+    pose = DOUBLE_PRECISION_POSE if flags & FLAG_DOUBLE_PRECISION else SINGLE_PRECISION_POSE
+
+    packet = [HEADER.pack(POSE_PACKET_MAGIC, POSE_PACKET_VERSION, flags, len(detection_result['targets']),
+                          sequence & 0xFFFFFFFF, *packet_timestamps(detection_result))]
+    for target_index, target in enumerate(detection_result['targets']):
+        if target['success']:
+            packet.append(TARGET_HEADER.pack(target_index, FLAG_SUCCESS))
+            packet.append(pose.pack(*[target[field] for field in POSE_FIELDS]))
+        else:
+            packet.append(TARGET_HEADER.pack(target_index, 0))
+
+    return b''.join(packet)
+
+
+def packet_timestamps(detection_result):
+    # Results that were not stamped by the pipeline only have the time they were processed at.
+    timestamp = detection_result['timestamp']
+
+    return (detection_result.get('capture_timestamp', timestamp),
+            detection_result.get('processed_timestamp', timestamp),
+            detection_result.get('sent_timestamp', timestamp))
+
+
+def stamp_pose_packet(packet, sent_timestamp):
+    packet = bytearray(packet)
+    SENT_TIMESTAMP.pack_into(packet, SENT_TIMESTAMP_OFFSET, sent_timestamp)
+
+    return packet
+
+
+def is_pose_packet(data):
+    return data[:len(POSE_PACKET_MAGIC)] == POSE_PACKET_MAGIC
+
+
+def decode_pose_packet(data):
+    magic, version, flags, fields_count, sequence, capture_timestamp, processed_timestamp, sent_timestamp = \
+        HEADER.unpack_from(data)
+
+    if magic != POSE_PACKET_MAGIC:
+        raise ValueError("Not a pose packet")
+
+    if version != POSE_PACKET_VERSION:
+        raise ValueError(
+            "Unsupported pose packet version. Received: {}".format(version))
+
+    detection_result = {}
+    detection_result['timestamp'] = processed_timestamp
+    detection_result['capture_timestamp'] = capture_timestamp
+    detection_result['processed_timestamp'] = processed_timestamp
+    detection_result['sent_timestamp'] = sent_timestamp
+    detection_result['sequence'] = sequence
+    detection_result['success'] = bool(flags & FLAG_SUCCESS)
+
+    pose = DOUBLE_PRECISION_POSE if flags & FLAG_DOUBLE_PRECISION else SINGLE_PRECISION_POSE
+
+    if flags & FLAG_MULTI_TARGET:
+        detection_result['targets'] = []
+        offset = HEADER.size
+        for _ in range(0, fields_count):
+            target_index, target_flags = TARGET_HEADER.unpack_from(data, offset)
+            offset += TARGET_HEADER.size
+
+            target = {'target': target_index,
+                      'success': bool(target_flags & FLAG_SUCCESS)}
+            if target['success']:
+                target.update(zip(POSE_FIELDS, pose.unpack_from(data, offset)))
+                offset += pose.size
+
+            detection_result['targets'].append(target)
+
+    elif fields_count > 0:
+        values = pose.unpack_from(data, HEADER.size)
+        for field, value in zip(POSE_FIELDS, values):
+            detection_result[field] = value
+
+    return detection_result
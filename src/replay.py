@@ -0,0 +1,186 @@
+import argparse
+import os
+import socket
+import struct
+import time
+import cv2
+from frame_grabber import CapturedFrame
+from pose_packet import JSON_FORMAT, BINARY_FORMAT
+from tracking import Tracking, TrackingCofig, serialize
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+# Binary packets written to a file are prefixed by their length.
+PACKET_LENGTH = struct.Struct('<I')
+
+
+class ReplaySource:
+
+    def __init__(self, path, fps=30.0):
+        # Recorded video file or directory of images, read in order, every frame is kept.
+        self.__fps = fps
+        self.__sequence = 0
+        self.__last_timestamp = None
+        self.__video_capture = None
+        self.__image_paths = None
+
+        if os.path.isdir(path):
+            self.__image_paths = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            self.__video_capture = cv2.VideoCapture(path)
+            if not self.__video_capture.isOpened():
+                raise FileNotFoundError(
+                    "Could not open the video. Received: {}".format(path))
+
+            video_fps = self.__video_capture.get(cv2.CAP_PROP_FPS)
+            if video_fps > 0:
+                self.__fps = video_fps
+
+    def read(self):
+        if self.__image_paths is not None:
+            if self.__sequence >= len(self.__image_paths):
+                return None
+            image = cv2.imread(self.__image_paths[self.__sequence])
+            if image is None:
+                return None
+        else:
+            grabbed, image = self.__video_capture.read()
+            if not grabbed:
+                return None
+
+        read_timestamp = time.monotonic()
+
+        # Timestamps come from the recording, not from the wall clock, so the filter
+        # sees the same time steps it saw live.
+        timestamp = self.__sequence / self.__fps
+        if self.__video_capture is not None:
+            # Variable frame rate recordings keep their own timing.
+            position = self.__video_capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if self.__last_timestamp is None or position > self.__last_timestamp:
+                timestamp = position
+            else:
+                timestamp = self.__last_timestamp + 1 / self.__fps
+        self.__last_timestamp = timestamp
+
+        captured_frame = CapturedFrame(self.__sequence, timestamp, image, read_timestamp, None)
+        self.__sequence += 1
+
+        return captured_frame
+
+    def release(self):
+        if self.__video_capture is not None:
+            self.__video_capture.release()
+
+
+class Replay:
+
+    def __init__(self, tracking, source, output_path=None, udp_address=None, wire_format=JSON_FORMAT,
+                 filtered=False):
+        self.__tracking = tracking
+        self.__source = source
+        self.__output_path = output_path
+        self.__udp_address = udp_address
+        self.__wire_format = wire_format
+        self.__filtered = filtered
+
+    def run(self):
+        output = None
+        if self.__output_path is not None:
+            output = open(self.__output_path, 'wb')
+
+        sock = None
+        if self.__udp_address is not None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        frames = 0
+        detected_frames = 0
+        start = time.perf_counter()
+        try:
+            for tracked_frame in self.__tracking.tracked_frames(self.__source.read):
+                detection_result = tracked_frame.filtered_detection_result if self.__filtered \
+                    else tracked_frame.detection_result
+                detection_result['sent_timestamp'] = time.time()
+                data = serialize(detection_result, tracked_frame.captured_frame.sequence,
+                                 self.__wire_format)
+
+                if output is not None:
+                    if self.__wire_format == BINARY_FORMAT:
+                        output.write(PACKET_LENGTH.pack(len(data)))
+                        output.write(data)
+                    else:
+                        output.write(data + b'\n')
+
+                if sock is not None:
+                    sock.sendto(data, self.__udp_address)
+                self.__tracking.instrumentation.record(
+                    'capture_to_sent', detection_result['sent_timestamp'] - detection_result['capture_timestamp'])
+
+                frames += 1
+                if detection_result['success']:
+                    detected_frames += 1
+        finally:
+            elapsed = time.perf_counter() - start
+            self.__source.release()
+            if output is not None:
+                output.close()
+
+        return frames, detected_frames, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs a recorded video or image directory through the tracking pipeline, as fast as possible.")
+    parser.add_argument('source', help="video file or directory of images")
+    parser.add_argument('--output', help="file the results are written to")
+    parser.add_argument('--udp', help="address the results are sent to, as ip:port")
+    parser.add_argument('--format', choices=[JSON_FORMAT, BINARY_FORMAT],
+                        help="result format, the tracking config format by default")
+    parser.add_argument('--filtered', action='store_true',
+                        help="write the filtered poses instead of the detected ones")
+    parser.add_argument('--fps', type=float, default=30.0,
+                        help="frame rate of image directories and of videos without one")
+    parser.add_argument('--device-parameters-dir',
+                        help="camera calibration directory, the tracking config one by default")
+    parser.add_argument('--workers', type=int,
+                        help="detection worker processes, the tracking config count by default")
+    parser.add_argument('--no-roi', action='store_true',
+                        help="search the whole frame for markers every frame")
+    parser.add_argument('--detection-scale', type=float,
+                        help="scale markers are searched at, 0 adapts it to the marker size, the tracking config one by default")
+    args = parser.parse_args()
+
+    tracking_config = TrackingCofig.persisted()
+    if tracking_config.marker_detection_settings is None:
+        parser.error("No marker detection settings saved, configure them in the application first")
+
+    udp_address = None
+    if args.udp is not None:
+        ip, port = args.udp.rsplit(':', 1)
+        udp_address = (ip, int(port))
+
+    tracking = Tracking(
+        pose_mailbox=None,
+        device_number=None,
+        device_parameters_dir=args.device_parameters_dir or tracking_config.device_parameters_dir,
+        show_video=False,
+        marker_detection_settings=tracking_config.marker_detection_settings,
+        translation_offset=tracking_config.translation_offset,
+        roi_detection=tracking_config.roi_detection and not args.no_roi,
+        detection_workers=args.workers or tracking_config.detection_workers,
+        max_frames_in_flight=tracking_config.max_frames_in_flight,
+        detection_scale=tracking_config.detection_scale if args.detection_scale is None else args.detection_scale,
+        cube_board_pose=tracking_config.cube_board_pose)
+
+    replay = Replay(tracking, ReplaySource(args.source, args.fps), args.output, udp_address,
+                    args.format or tracking_config.wire_format, args.filtered)
+    frames, detected_frames, elapsed = replay.run()
+
+    print("{} frames in {:.2f} s, {:.1f} frames/s, targets found in {} frames".format(
+        frames, elapsed, frames / elapsed if elapsed > 0 else 0.0, detected_frames))
+    for line in tracking.instrumentation.report_lines():
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
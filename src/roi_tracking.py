@@ -0,0 +1,64 @@
+import numpy as np
+
+
+class RegionOfInterestTracker:
+
+    def __init__(self, padding=0.5, min_padding=16, max_misses=3, full_scan_interval=30, max_area_ratio=0.5):
+        # padding is relative to the size of the last detection, min_padding is in pixels.
+        self.__padding = padding
+        self.__min_padding = min_padding
+        self.__max_misses = max_misses
+        self.__full_scan_interval = full_scan_interval
+        self.__max_area_ratio = max_area_ratio
+
+        self.__bounds = None
+        self.__misses = 0
+        self.__frames_since_full_scan = 0
+
+    def region(self, frame_shape, motion=(0, 0)):
+        height, width = frame_shape[:2]
+
+        if self.__bounds is None or self.__misses >= self.__max_misses \
+                or self.__frames_since_full_scan >= self.__full_scan_interval:
+            self.__frames_since_full_scan = 0
+            return None
+
+        x_min, y_min, x_max, y_max = self.__bounds
+        motion_x, motion_y = motion
+
+        # Moves the box along the predicted motion and grows it by the same amount,
+        # so both the last and the predicted position stay inside the search region.
+        padding = max(self.__min_padding,
+                      self.__padding * max(x_max - x_min, y_max - y_min))
+        x_min = int(min(x_min, x_min + motion_x) - padding - abs(motion_x))
+        y_min = int(min(y_min, y_min + motion_y) - padding - abs(motion_y))
+        x_max = int(max(x_max, x_max + motion_x) + padding + abs(motion_x)) + 1
+        y_max = int(max(y_max, y_max + motion_y) + padding + abs(motion_y)) + 1
+
+        x_min = max(0, x_min)
+        y_min = max(0, y_min)
+        x_max = min(width, x_max)
+        y_max = min(height, y_max)
+
+        if x_max <= x_min or y_max <= y_min:
+            self.__frames_since_full_scan = 0
+            return None
+
+        if (x_max - x_min) * (y_max - y_min) > self.__max_area_ratio * width * height:
+            self.__frames_since_full_scan = 0
+            return None
+
+        self.__frames_since_full_scan += 1
+        return x_min, y_min, x_max, y_max
+
+    def found(self, corners):
+        points = np.concatenate([np.reshape(marker_corners, (-1, 2))
+                                 for marker_corners in corners])
+        x_min, y_min = points.min(axis=0)
+        x_max, y_max = points.max(axis=0)
+
+        self.__bounds = (float(x_min), float(y_min), float(x_max), float(y_max))
+        self.__misses = 0
+
+    def lost(self):
+        self.__misses += 1
@@ -0,0 +1,116 @@
+import os
+from multiprocessing import shared_memory
+import numpy as np
+
+# Header: slots, height, width, channels, followed by the sequence of each slot.
+HEADER_FIELDS = 4
+EMPTY_SLOT = -1
+WRITING_SLOT = -2
+
+
+class SharedFrameRing:
+
+    def __init__(self, memory, owner):
+        self.__memory = memory
+        self.__owner = owner
+
+        self.__header = np.ndarray(
+            (HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf)
+        slots, height, width, channels = (int(value)
+                                          for value in self.__header)
+
+        offset = HEADER_FIELDS * 8
+        self.__slot_sequences = np.ndarray(
+            (slots,), dtype=np.int64, buffer=memory.buf, offset=offset)
+        offset += slots * 8
+        self.__frames = np.ndarray(
+            (slots, height, width, channels), dtype=np.uint8, buffer=memory.buf, offset=offset)
+
+        self.slots = slots
+        self.shape = (height, width, channels)
+
+    @classmethod
+    def create(cls, name, shape, slots):
+        height, width, channels = shape
+        size = (HEADER_FIELDS + slots) * 8 + \
+            slots * height * width * channels
+
+        try:
+            memory = shared_memory.SharedMemory(
+                name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a tracking process that was terminated.
+            stale_memory = shared_memory.SharedMemory(name=name)
+            stale_memory.close()
+            stale_memory.unlink()
+            memory = shared_memory.SharedMemory(
+                name=name, create=True, size=size)
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=memory.buf)
+        header[:] = [slots, height, width, channels]
+        np.ndarray((slots,), dtype=np.int64, buffer=memory.buf,
+                   offset=HEADER_FIELDS * 8)[:] = EMPTY_SLOT
+        del header
+
+        return cls(memory, True)
+
+    @classmethod
+    def attach(cls, name, shares_tracker=False):
+        memory = shared_memory.SharedMemory(name=name)
+
+        # On POSIX, processes started by the app share the resource tracker of the owner, their
+        # registration is the owner's one and is kept, the owner unlinks the ring itself. Other
+        # processes have their own tracker, which would unlink the ring when they exit.
+        if os.name == 'posix' and not shares_tracker:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(
+                memory._name, 'shared_memory')  # pylint: disable=protected-access
+
+        return cls(memory, False)
+
+    @classmethod
+    def unlink(cls, name):
+        # Removes the ring of an owner that was terminated before it could close it.
+        try:
+            memory = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+
+        memory.close()
+        memory.unlink()
+
+    @property
+    def name(self):
+        return self.__memory.name
+
+    def __reduce__(self):
+        return (SharedFrameRing.attach, (self.__memory.name, True))
+
+    def begin_write(self, sequence):
+        # Returns the slot the frame must be written to, readers ignore it until end_write.
+        slot = sequence % self.slots
+        self.__slot_sequences[slot] = WRITING_SLOT
+
+        return self.__frames[slot]
+
+    def end_write(self, sequence):
+        self.__slot_sequences[sequence % self.slots] = sequence
+
+    def frame(self, sequence):
+        # The returned view is only meaningful while valid(sequence) holds, writers
+        # overwrite the slot after another `slots` frames.
+        if not self.valid(sequence):
+            return None
+
+        return self.__frames[sequence % self.slots]
+
+    def valid(self, sequence):
+        return sequence >= 0 and self.__slot_sequences[sequence % self.slots] == sequence
+
+    def close(self):
+        del self.__header
+        del self.__slot_sequences
+        del self.__frames
+
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
@@ -6,13 +6,52 @@ except ModuleNotFoundError:
 import os
 import json
 import socket
-from multiprocessing import Process, Queue
-import time
+import collections
 import math
+from multiprocessing import Process, Queue, Event
+from queue import Empty, Full
+import time
 import numpy as np
 import cv2
-import cv2.aruco as aruco
-from marker_detection_settings import SINGLE_DETECTION, CUBE_DETECTION
+from marker_detection_settings import MULTI_DETECTION
+from roi_tracking import RegionOfInterestTracker
+from frame_grabber import FrameGrabber, CaptureMode, apply_capture_mode
+from marker_pose_estimation import MarkerPoseEstimator, detection_targets
+from detection_pool import DetectionWorkerPool
+from shared_frame_ring import SharedFrameRing
+from pose_packet import JSON_FORMAT, BINARY_FORMAT, encode_pose_packet, stamp_pose_packet
+from pose_filter import PoseFilter, PoseState, predict_pose
+from pose_mailbox import PoseMailbox
+from instrumentation import Instrumentation
+from frame_preview import FramePreview, PreviewData
+
+# Result of one processed frame.
+TrackedFrame = collections.namedtuple(
+    'TrackedFrame', ['captured_frame', 'estimation', 'detection_result', 'filtered_detection_result',
+                     'pose_states'])
+
+# Filter states handed to the publisher, which extrapolates them on its own clock, with the
+# wall clock times the frame they come from was captured and processed at.
+PosePrediction = collections.namedtuple(
+    'PosePrediction', ['sequence', 'states', 'capture_timestamp', 'processed_timestamp'])
+# Values of each filter state in an encoded prediction: timestamp, translation and rotation states.
+PREDICTION_STATE_SIZE = 1 + 9 + 8
+
+# Targets not seen for longer than this are no longer extrapolated.
+MAX_PREDICTION_TIME = 0.25
+# Poses are not extrapolated further than this past the frame they were filtered from, however
+# long the prediction lead is.
+MAX_EXTRAPOLATION_TIME = 0.5
+# Timed waits are coarse on some platforms, the end of each output period is spun.
+OUTPUT_SPIN_TIME = 0.002
+
+# A detection scale of 0 picks the pyramid level from the size of the markers in the previous frame.
+AUTO_DETECTION_SCALE = 0
+# Side in pixels the smallest tracked marker keeps on the downscaled image.
+MIN_DETECTED_MARKER_SIDE = 48
+MIN_DETECTION_SCALE = 0.25
+# Without markers to go by, the whole frame is searched at about this width.
+SEARCH_WIDTH = 1920
 
 
 class TrackingScheduler:
@@ -22,30 +61,75 @@ class TrackingScheduler:
 
     def main(self):
 
+        run = 0
         while True:
             self.start_tracking.wait()
             self.start_tracking.clear()
+            run += 1
 
             tracking_config = TrackingCofig.persisted()
-            queue = Queue(1)
-            filtered_queue = Queue(1)
+            frame_ring_name = None
+            if tracking_config.share_frames or tracking_config.show_video:
+                # A new name each run, so the preview never attaches to the ring of a terminated run.
+                frame_ring_name = "ar_tracking_frames_{}_{}".format(os.getpid(), run)
+
+            # Latest serialized pose, or latest filter states when the publisher runs at its own rate.
+            pose_mailbox = PoseMailbox.create("ar_tracking_poses_{}_{}".format(os.getpid(), run))
+            quit_event = Event()
+
+            preview_queue = None
+            preview_process = None
+            if tracking_config.show_video:
+                preview_queue = Queue(1)
+                preview_process = Process(target=FramePreview(
+                    frame_ring_name=frame_ring_name,
+                    preview_queue=preview_queue,
+                    quit_event=quit_event,
+                    device_parameters_dir=tracking_config.device_parameters_dir,
+                    preview_rate=tracking_config.preview_rate
+                ).show)
+                preview_process.start()
+
+            # Tracking parses the detection settings, so it is only built in its own process, where
+            # invalid settings end that run instead of the scheduler.
+            tracking_arguments = dict(
+                pose_mailbox=pose_mailbox,
+                device_number=tracking_config.device_number,
+                device_parameters_dir=tracking_config.device_parameters_dir,
+                show_video=tracking_config.show_video,
+                marker_detection_settings=tracking_config.marker_detection_settings,
+                translation_offset=tracking_config.translation_offset,
+                roi_detection=tracking_config.roi_detection,
+                detection_workers=tracking_config.detection_workers,
+                max_frames_in_flight=tracking_config.max_frames_in_flight,
+                frame_ring_name=frame_ring_name,
+                wire_format=tracking_config.wire_format,
+                prediction_lead=tracking_config.prediction_lead,
+                output_rate=tracking_config.output_rate,
+                instrumentation=tracking_config.instrumentation,
+                show_instrumentation=tracking_config.show_instrumentation,
+                preview_queue=preview_queue,
+                quit_event=quit_event,
+                preview_rate=tracking_config.preview_rate,
+                detection_scale=tracking_config.detection_scale,
+                cube_board_pose=tracking_config.cube_board_pose,
+                capture_resolution=tracking_config.capture_resolution,
+                capture_fourcc=tracking_config.capture_fourcc,
+                capture_fps=tracking_config.capture_fps)
 
             client_process = Process(target=DataPublishClientUDP(
                 server_ip=tracking_config.server_ip,
                 server_port=int(tracking_config.server_port),
-                queue=queue,
-                filtered_queue=filtered_queue
+                pose_mailbox=pose_mailbox,
+                marker_detection_settings=tracking_config.marker_detection_settings,
+                wire_format=tracking_config.wire_format,
+                prediction_lead=tracking_config.prediction_lead,
+                output_rate=tracking_config.output_rate,
+                instrumentation=tracking_config.instrumentation
             ).listen)
             client_process.start()
 
-            tracking_process = Process(target=Tracking(
-                queue=queue,
-                filtered_queue=filtered_queue,
-                device_number=tracking_config.device_number,
-                device_parameters_dir=tracking_config.device_parameters_dir,
-                show_video=tracking_config.show_video,
-                marker_detection_settings=tracking_config.marker_detection_settings,
-                translation_offset=tracking_config.translation_offset).track)
+            tracking_process = Process(target=run_tracking, kwargs=tracking_arguments)
             tracking_process.start()
 
             while True:
@@ -53,25 +137,73 @@ class TrackingScheduler:
 
                 if not tracking_process.is_alive():
                     client_process.terminate()
+                    if preview_process is not None:
+                        preview_process.terminate()
                     self.stop_tracking.clear()
                     break
 
                 if self.stop_tracking.wait(0):
                     tracking_process.terminate()
                     client_process.terminate()
+                    if preview_process is not None:
+                        preview_process.terminate()
                     self.stop_tracking.clear()
                     break
 
+            # Stopping terminates tracking, which then never unlinks its frame ring.
+            tracking_process.join()
+            SharedFrameRing.unlink(frame_ring_name or private_frame_ring_name(tracking_process.pid))
+            pose_mailbox.close()
+
+
+def run_tracking(**tracking_arguments):
+    Tracking(**tracking_arguments).track()
+
 
 class Tracking:
-    def __init__(self, queue, filtered_queue, device_number, device_parameters_dir, show_video, marker_detection_settings, translation_offset):
-        self.__data_queue = queue
-        self.__filtered_data_queue = filtered_queue
+    def __init__(self, pose_mailbox, device_number, device_parameters_dir, show_video, marker_detection_settings, translation_offset,
+                 roi_detection=True, detection_workers=1, max_frames_in_flight=4, frame_ring_name=None,
+                 wire_format=JSON_FORMAT, prediction_lead=0.0, output_rate=0, instrumentation=True,
+                 show_instrumentation=False, preview_queue=None, quit_event=None, preview_rate=15,
+                 detection_scale=1.0, cube_board_pose=True, capture_resolution=(1280, 720), capture_fourcc="",
+                 capture_fps=0):
+        self.__pose_mailbox = pose_mailbox
         self.__device_number = device_number
-        self.__device_parameters_dir = device_parameters_dir
+        # Any resolution with the aspect ratio of the calibration one, the intrinsics are rescaled.
+        self.__capture_resolution = capture_resolution
+        self.__capture_fourcc = capture_fourcc
+        self.__capture_fps = capture_fps
         self.__show_video = show_video
-        self.__marker_detection_settings = marker_detection_settings
-        self.__translation_offset = translation_offset
+        self.__roi_detection = roi_detection
+        self.__roi_tracker = RegionOfInterestTracker()
+        # Set while some targets are found and others are not.
+        self.__targets_missing = False
+        # Markers are located on a downscaled frame, their corners found on the full resolution one.
+        self.__detection_scale = detection_scale
+        self.__marker_side = None
+        # Interval between the processed frames, measured from their capture timestamps.
+        self.__frame_time = 0.0334
+        self.__last_capture_timestamp = None
+        self.__detection_workers = detection_workers
+        self.__max_frames_in_flight = max_frames_in_flight
+        self.__frame_ring_name = frame_ring_name
+        self.__wire_format = wire_format
+        self.__prediction_lead = prediction_lead
+        self.__output_rate = output_rate
+        self.__instrumentation = Instrumentation('tracking', instrumentation)
+        self.__show_instrumentation = show_instrumentation
+        # The preview runs in another process, fed at preview_rate with the frame sequence and the poses.
+        self.__preview_queue = preview_queue
+        self.__quit_event = quit_event
+        self.__preview_rate = preview_rate
+        self.__multi_target = marker_detection_settings.identifier == MULTI_DETECTION
+        self.__estimator = MarkerPoseEstimator(
+            device_parameters_dir, marker_detection_settings, translation_offset,
+            cube_board_pose=cube_board_pose)
+
+    @property
+    def instrumentation(self):
+        return self.__instrumentation
 
     def track(self):
         #Descomentar quando nao for utilizar o DroidCam
@@ -80,305 +212,368 @@ class Tracking:
         video_capture = cv2.VideoCapture(
             self.__device_number)
 
-        video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-        video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-
-        detection_result = {}
-        filtered_detection_result = {}
-        kalman_filter = create_kalman_filter(9, 3, 0.0334)
-        while True:
-            _, frame = video_capture.read()
-
-            if self.__marker_detection_settings.identifier == SINGLE_DETECTION:
-                detection_result, filtered_detection_result = self.__single_marker_detection(frame, kalman_filter, filtered_detection_result)
-            elif self.__marker_detection_settings.identifier == CUBE_DETECTION:
-                detection_result, filtered_detection_result = self.__markers_cube_detection(frame, kalman_filter, filtered_detection_result)
-            else:
-                raise Exception("Invalid detection identifier. Received: {}".format(
-                    self.__marker_detection_settings.identifier))
-
-            self.__publish_coordinates(json.dumps(detection_result), json.dumps(filtered_detection_result))
+        capture_width, capture_height = self.__capture_resolution
+        apply_capture_mode(video_capture, CaptureMode(
+            self.__capture_fourcc, capture_width, capture_height, self.__capture_fps))
 
-            if self.__show_video:
-                self.__show_video_result(frame, filtered_detection_result)
-
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+        # Drivers silently fall back to another size, the calibration is checked against the one
+        # actually delivered before any frame is processed.
+        delivered_width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        delivered_height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        try:
+            self.__estimator.camera_parameters((delivered_width, delivered_height))
+        except Exception as error:
+            video_capture.release()
+            raise Exception("Camera {} delivers {}x{} frames, {}x{} were requested. {}".format(
+                self.__device_number, delivered_width, delivered_height, capture_width, capture_height,
+                error)) from error
+
+        frame_ring = None
+        if self.__frame_ring_name is not None or self.__detection_workers > 1:
+            frame_ring = self.__create_frame_ring(video_capture)
+
+        frame_grabber = FrameGrabber(video_capture, frame_ring=frame_ring).start()
+
+        instrumentation = self.__instrumentation
+        show_preview = self.__show_video and self.__preview_queue is not None and frame_ring is not None
+        last_preview_time = 0.0
+        last_frame_time = None
+        tracked_frames = self.tracked_frames(frame_grabber.read, frame_ring)
+        for tracked_frame in tracked_frames:
+            self.__publish_coordinates(tracked_frame)
+
+            frame_time = time.perf_counter()
+            if show_preview and frame_time - last_preview_time >= 1.0 / self.__preview_rate:
+                last_preview_time = frame_time
+                with instrumentation.measure('preview'):
+                    self.__send_preview(tracked_frame, frame_grabber.dropped_frames)
+
+            if self.__quit_event is not None and self.__quit_event.is_set():
                 break
 
-        video_capture.release()
-        cv2.destroyAllWindows()
-
-    def __single_marker_detection(self, frame, filter, last_detection_result):
-
-        corners, ids = self.__detect_markers(frame)
-
-        marker_rvec = None
-        marker_tvec = None
-        if np.all(ids is not None):
-            marker_found = False
-            marker_index = None
-
-            for i in range(0, ids.size):
-                if ids[i][0] == self.__marker_detection_settings.marker_id:
-                    marker_found = True
-                    marker_index = i
-                    break
-
-            if marker_found:
-                cam_mtx, dist = self.__camera_parameters()
-                rvecs, tvecs, _ = aruco.estimatePoseSingleMarkers(
-                    corners, float(self.__marker_detection_settings.marker_length), cam_mtx, dist)
-
-                marker_position = self.__get_position_matrix(
-                    rvecs[marker_index], tvecs[marker_index])
-
-                marker_position = self.__apply_transformation(
-                    marker_position, self.__translation_offset)
-
-                marker_rvec, marker_tvec = self.__get_rvec_and_tvec(
-                    marker_position)
+            if last_frame_time is not None:
+                instrumentation.record('frame_interval', frame_time - last_frame_time)
+            last_frame_time = frame_time
 
-                aruco.drawAxis(frame, cam_mtx, dist,
-                               marker_rvec, marker_tvec, 5)
+            instrumentation.dump_periodically()
 
-        return self.__detection_result(marker_rvec, marker_tvec, filter, last_detection_result)
+        tracked_frames.close()
+        if instrumentation.enabled:
+            instrumentation.dump()
 
-    def __markers_cube_detection(self, frame, filter, last_detection_result):
-        corners, ids = self.__detect_markers(frame)
-
-        main_marker_rvec = None
-        main_marker_tvec = None
-        if np.all(ids is not None):
-
-            cam_mtx, dist = self.__camera_parameters()
-            rvecs, tvecs, _ = aruco.estimatePoseSingleMarkers(
-                corners, float(self.__marker_detection_settings.markers_length), cam_mtx, dist)
-
-            choosen_marker_index = 0
-            choosen_marker_id = ids[0][0]
-            for i in range(0, ids.size):
-                if tvecs[choosen_marker_index][0][2] > tvecs[i][0][2]:
-                    choosen_marker_id = ids[i][0]
-                    choosen_marker_index = i
+        frame_grabber.stop()
+        video_capture.release()
 
-            choosen_marker_position = self.__get_position_matrix(
-                rvecs[choosen_marker_index], tvecs[choosen_marker_index])
+        if frame_ring is not None:
+            frame_ring.close()
+
+    def tracked_frames(self, read_frame, frame_ring=None):
+        # Runs every frame returned by read_frame through detection, pose estimation and
+        # filtering, until it returns None. Frames come out in capture order.
+        detection_pool = None
+        if self.__detection_workers > 1:
+            detection_pool = DetectionWorkerPool(
+                self.__estimator, self.__detection_workers, self.__max_frames_in_flight, frame_ring).start()
+
+        instrumentation = self.__instrumentation
+        target_names = self.__estimator.target_names
+        pose_filters = [PoseFilter(nominal_time_step=self.__frame_time)
+                        for _ in target_names]
+        try:
+            while True:
+                with instrumentation.measure('capture_wait'):
+                    captured_frame = read_frame()
 
-            if choosen_marker_id != self.__marker_detection_settings.up_marker_id:
-                choosen_marker_position = self.__apply_transformation(
-                    choosen_marker_position, self.__marker_detection_settings.transformations[choosen_marker_id])
+                if captured_frame is None:
+                    if detection_pool is None or detection_pool.in_flight == 0:
+                        break
+                    with instrumentation.measure('detection_wait'):
+                        estimations = detection_pool.completed(block=True)
+                elif detection_pool is None:
+                    with instrumentation.measure('detection'):
+                        region = self.__search_region(captured_frame.image, pose_filters, 1)
+                        estimation = self.__estimator.estimate(
+                            captured_frame.image, region, self.__frame_detection_scale(captured_frame.image))
+                        if frame_ring is not None and not frame_ring.valid(captured_frame.sequence):
+                            # The grabber reused the ring slot while the frame was being processed.
+                            estimation = self.__estimator.empty_estimation()
+                        estimations = [(captured_frame, estimation)]
+                else:
+                    # The filter lags behind the frames still being processed.
+                    with instrumentation.measure('detection_wait'):
+                        region = self.__search_region(
+                            captured_frame.image, pose_filters, detection_pool.in_flight + 1)
+                        detection_pool.submit(
+                            captured_frame, region, self.__frame_detection_scale(captured_frame.image))
+                        estimations = detection_pool.completed(block=detection_pool.full)
+
+                for captured_frame, estimation in estimations:
+                    yield self.__tracked_frame(captured_frame, estimation, target_names, pose_filters)
+        finally:
+            if detection_pool is not None:
+                detection_pool.stop()
+
+    def __tracked_frame(self, captured_frame, estimation, target_names, pose_filters):
+        self.__instrumentation.record_all(estimation.timings)
+        self.__update_frame_time(captured_frame.timestamp)
+
+        # Messages carry wall clock times, latencies are measured on the monotonic clock.
+        processed_time = time.monotonic()
+        processed_timestamp = time.time()
+        capture_timestamp = processed_timestamp - (processed_time - captured_frame.read_timestamp)
+        self.__instrumentation.record('capture_to_processed', processed_time - captured_frame.read_timestamp)
+
+        if estimation.target_corners is not None:
+            self.__roi_tracker.found(estimation.target_corners)
+            self.__marker_side = smallest_marker_side(estimation.target_corners)
+        else:
+            self.__roi_tracker.lost()
+            self.__marker_side = None
+
+        # The region only covers the targets that were found, the others are searched for on the whole frame.
+        found_targets = sum(target_pose is not None for target_pose in estimation.target_poses)
+        self.__targets_missing = 0 < found_targets < len(estimation.target_poses)
+
+        detection_results = []
+        filtered_detection_results = []
+        with self.__instrumentation.measure('filter'):
+            for target_pose, pose_filter in zip(estimation.target_poses, pose_filters):
+                detection_result, filtered_detection_result = self.__detection_result(
+                    target_pose, pose_filter, captured_frame.timestamp)
+                detection_results.append(detection_result)
+                filtered_detection_results.append(filtered_detection_result)
+
+        return TrackedFrame(
+            captured_frame, estimation,
+            stamp_frame_message(frame_message(target_names, detection_results, self.__multi_target),
+                                captured_frame.sequence, capture_timestamp, processed_timestamp,
+                                captured_frame.device_timestamp),
+            stamp_frame_message(frame_message(target_names, filtered_detection_results, self.__multi_target),
+                                captured_frame.sequence, capture_timestamp, processed_timestamp,
+                                captured_frame.device_timestamp),
+            [pose_filter.state() for pose_filter in pose_filters])
+
+    def __send_preview(self, tracked_frame, dropped_frames):
+        instrumentation_lines = []
+        if self.__show_instrumentation:
+            instrumentation_lines = self.__instrumentation.report_lines()
+
+        put_latest(self.__preview_queue, PreviewData(
+            tracked_frame.captured_frame.sequence, tracked_frame.estimation.corners,
+            tracked_frame.estimation.target_poses, tracked_frame.filtered_detection_result,
+            dropped_frames, instrumentation_lines))
+
+    def __create_frame_ring(self, video_capture):
+        grabbed, frame = video_capture.read()
+        if not grabbed:
+            return None
+
+        name = self.__frame_ring_name
+        if name is None:
+            name = private_frame_ring_name(os.getpid())
+
+        # Frames being captured, waiting to be read, in flight and being shown by other processes.
+        slots = 2 + self.__max_frames_in_flight + 6
+
+        return SharedFrameRing.create(name, frame.shape, slots)
+
+    def __search_region(self, frame, filters, frames_ahead):
+        if not self.__roi_detection or self.__targets_missing:
+            return None
+
+        # The fastest target decides how much the region grows.
+        motion = max((self.__predicted_motion(filter, frames_ahead, frame.shape) for filter in filters),
+                     key=lambda motion: abs(motion[0]) + abs(motion[1]), default=(0, 0))
+
+        return self.__roi_tracker.region(frame.shape, motion)
+
+    def __frame_detection_scale(self, frame):
+        if self.__detection_scale != AUTO_DETECTION_SCALE:
+            return self.__detection_scale
+
+        if self.__marker_side is None:
+            scale = SEARCH_WIDTH / frame.shape[1]
+        else:
+            scale = MIN_DETECTED_MARKER_SIDE / self.__marker_side
+
+        # Whole pyramid levels, so the scale does not change with every small move of the markers.
+        if scale >= 1:
+            return 1.0
+        return max(2.0 ** math.floor(math.log2(scale)), MIN_DETECTION_SCALE)
+
+    def __update_frame_time(self, capture_timestamp):
+        if self.__last_capture_timestamp is not None:
+            interval = capture_timestamp - self.__last_capture_timestamp
+            if 0 < interval < 1:
+                self.__frame_time = 0.9 * self.__frame_time + 0.1 * interval
+
+        self.__last_capture_timestamp = capture_timestamp
+
+    def __predicted_motion(self, pose_filter, frames_ahead, frame_shape):
+        # Projects the displacement predicted by the pose filter for the next frames into pixels.
+        if not pose_filter.initialized:
+            return 0, 0
+
+        position = pose_filter.translation
+        if position[2] <= 0:
+            return 0, 0
+
+        cam_mtx, _ = self.__estimator.camera_parameters((frame_shape[1], frame_shape[0]))
+
+        predicted_position = pose_filter.predict_translation(
+            pose_filter.timestamp + self.__frame_time * frames_ahead)
+        predicted_z = max(predicted_position[2], 1e-6)
+
+        motion_x = cam_mtx.item(0, 0) * \
+            (predicted_position[0] / predicted_z - position[0] / position[2])
+        motion_y = cam_mtx.item(1, 1) * \
+            (predicted_position[1] / predicted_z - position[1] / position[2])
+
+        return motion_x, motion_y
+
+    def __detection_result(self, position, pose_filter, capture_timestamp):
+        detection_result = {}
+        detection_result['timestamp'] = time.time()
+        detection_result['success'] = position is not None
 
-            choosen_marker_position = self.__apply_transformation(
-                choosen_marker_position, self.__translation_offset)
+        filtered_detection_result = dict(detection_result)
 
-            main_marker_rvec, main_marker_tvec = self.__get_rvec_and_tvec(
-                choosen_marker_position)
+        if position is not None:
+            set_pose_fields(detection_result, position[:3, :3], position[:3, 3])
 
-            aruco.drawAxis(frame, cam_mtx, dist,
-                           main_marker_rvec, main_marker_tvec, 5)
+            # The filter runs on capture time, so dropped and late frames stretch its step.
+            pose_filter.update(capture_timestamp, position[:3, 3], position[:3, :3])
+            set_pose_fields(filtered_detection_result,
+                            pose_filter.rotation_matrix, pose_filter.translation)
 
-        return self.__detection_result(main_marker_rvec, main_marker_tvec, filter, last_detection_result)
+        return detection_result, filtered_detection_result
 
-    def __detect_markers(self, frame):
-        parameters = aruco.DetectorParameters_create()
-        parameters.adaptiveThreshConstant = 7
-        parameters.cornerRefinementMethod = aruco.CORNER_REFINE_CONTOUR
+    def __publish_coordinates(self, tracked_frame):
+        # The publisher only adds the time the message is sent at.
+        target_names = self.__estimator.target_names
+        detection_result = tracked_frame.detection_result
+        sequence = tracked_frame.captured_frame.sequence
 
-        corners, ids, _ = aruco.detectMarkers(
-            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
-            aruco.Dictionary_get(aruco.DICT_6X6_250),
-            parameters=parameters)
+        if self.__output_rate > 0:
+            with self.__instrumentation.measure('publish'):
+                self.__pose_mailbox.publish(encode_pose_prediction(PosePrediction(
+                    sequence, tracked_frame.pose_states, detection_result['capture_timestamp'],
+                    detection_result['processed_timestamp'])), detection_result['capture_timestamp'])
+            return
 
-        aruco.drawDetectedMarkers(frame, corners)
+        if self.__prediction_lead > 0:
+            with self.__instrumentation.measure('predict'):
+                # Extrapolated to the moment the pose is expected to be used.
+                now = time.monotonic()
+                detection_result = stamp_frame_message(
+                    frame_message(target_names, [predicted_detection_result(state, now, self.__prediction_lead)
+                                                 for state in tracked_frame.pose_states], self.__multi_target),
+                    sequence, detection_result['capture_timestamp'], detection_result['processed_timestamp'],
+                    detection_result.get('device_timestamp'))
 
-        return corners, ids
+        with self.__instrumentation.measure('serialize'):
+            data = serialize(detection_result, sequence, self.__wire_format)
 
-    def __camera_parameters(self):
-        cam_mtx = np.load(
-            "{}/cam_mtx.npy".format(self.__device_parameters_dir))
-        dist = np.load(
-            "{}/dist.npy".format(self.__device_parameters_dir))
+        with self.__instrumentation.measure('publish'):
+            self.__pose_mailbox.publish(data, detection_result['capture_timestamp'])
 
-        return cam_mtx, dist
 
-    def __get_position_matrix(self, rvec, tvec):
-        rot_mtx = np.zeros(shape=(3, 3))
-        cv2.Rodrigues(rvec, rot_mtx)
+class DataPublishClientUDP:
 
-        position = np.concatenate(
-            (rot_mtx, np.transpose(tvec)), axis=1)
-        position = np.concatenate(
-            (position, np.array([[0, 0, 0, 1]])))
+    def __init__(self, server_ip, server_port, pose_mailbox, marker_detection_settings, wire_format=JSON_FORMAT,
+                 prediction_lead=0.0, output_rate=0, instrumentation=True):
+        self.server_ip = server_ip
+        self.__server_port = server_port
+        self.__pose_mailbox = pose_mailbox
+        self.__marker_detection_settings = marker_detection_settings
+        self.__target_names = None
+        self.__multi_target = False
+        self.__wire_format = wire_format
+        self.__prediction_lead = prediction_lead
+        self.__output_rate = output_rate
+        self.__instrumentation = Instrumentation('publisher', instrumentation)
 
-        return position
+    def listen(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    def __get_rvec_and_tvec(self, position_matrix):
+        # Only extrapolated poses need the target names. As in tracking, the settings are parsed
+        # in this process, so invalid ones do not end the scheduler.
+        if self.__output_rate > 0:
+            self.__target_names = [name for name, _ in detection_targets(self.__marker_detection_settings)]
+            self.__multi_target = self.__marker_detection_settings.identifier == MULTI_DETECTION
 
-        tvec_t = np.delete(position_matrix[:, 3], (3))
+        if self.__output_rate > 0:
+            self.__publish_predictions(sock)
 
-        position_matrix = np.delete(
-            position_matrix, 3, 0)
-        position_matrix = np.delete(
-            position_matrix, 3, 1)
+        instrumentation = self.__instrumentation
+        while True:
+            with instrumentation.measure('mailbox_wait'):
+                capture_timestamp, data = self.__pose_mailbox.receive()
 
-        rvec_t, _ = cv2.Rodrigues(position_matrix)
+            self.__send(sock, data, capture_timestamp)
 
-        return rvec_t.T, tvec_t.T
+            instrumentation.dump_periodically()
 
-    def __apply_transformation(self, position_matrix, transformation):
-        return np.dot(position_matrix, transformation)
+    def __publish_predictions(self, sock):
+        # Publishes the latest filter states extrapolated to each tick of a fixed rate clock,
+        # independently of the camera frame rate.
+        instrumentation = self.__instrumentation
+        period = 1.0 / self.__output_rate
+        prediction = None
+        next_tick = time.monotonic()
 
-    def __detection_result(self, rvec, tvec, filter, last_detection_result):
-        filtered_detection_result = {}
-        detection_result = {}
+        while True:
+            remaining = next_tick - time.monotonic()
+            if remaining > 0:
+                message = self.__pose_mailbox.receive(max(remaining - OUTPUT_SPIN_TIME, 0))
+                if message is not None:
+                    prediction = decode_pose_prediction(message[1])
+                continue
 
-        filtered_detection_result['timestamp'] = time.time()
-        detection_result['timestamp'] = filtered_detection_result['timestamp']
-        last_detection_result['timestamp'] = filtered_detection_result['timestamp']
-
-        success = rvec is not None and tvec is not None
-        filtered_detection_result['success'] = success
-        detection_result['success'] = success
-
-        if success:
-            rot_mtx = np.zeros(shape=(3, 3))
-            cv2.Rodrigues(rvec, rot_mtx)
-
-            filtered_detection_result['translation_x'] = tvec.item(0)
-            filtered_detection_result['translation_y'] = tvec.item(1)
-            filtered_detection_result['translation_z'] = tvec.item(2)
-            filtered_detection_result['rotation_right_x'] = rot_mtx.item(0, 0)
-            filtered_detection_result['rotation_right_y'] = rot_mtx.item(1, 0)
-            filtered_detection_result['rotation_right_z'] = rot_mtx.item(2, 0)
-            filtered_detection_result['rotation_up_x'] = rot_mtx.item(0, 1)
-            filtered_detection_result['rotation_up_y'] = rot_mtx.item(1, 1)
-            filtered_detection_result['rotation_up_z'] = rot_mtx.item(2, 1)
-            filtered_detection_result['rotation_forward_x'] = rot_mtx.item(0, 2)
-            filtered_detection_result['rotation_forward_y'] = rot_mtx.item(1, 2)
-            filtered_detection_result['rotation_forward_z'] = rot_mtx.item(2, 2)
-
-            detection_result['translation_x'] = tvec.item(0)
-            detection_result['translation_y'] = tvec.item(1)
-            detection_result['translation_z'] = tvec.item(2)
-            detection_result['rotation_right_x'] = rot_mtx.item(0, 0)
-            detection_result['rotation_right_y'] = rot_mtx.item(1, 0)
-            detection_result['rotation_right_z'] = rot_mtx.item(2, 0)
-            detection_result['rotation_up_x'] = rot_mtx.item(0, 1)
-            detection_result['rotation_up_y'] = rot_mtx.item(1, 1)
-            detection_result['rotation_up_z'] = rot_mtx.item(2, 1)
-            detection_result['rotation_forward_x'] = rot_mtx.item(0, 2)
-            detection_result['rotation_forward_y'] = rot_mtx.item(1, 2)
-            detection_result['rotation_forward_z'] = rot_mtx.item(2, 2)
-
-            measurements = create_measurement_matrix(filtered_detection_result)
-            update_detection_result(filter, measurements, filtered_detection_result)
-
-            if last_detection_result.get('success', False):
-                detection_list = list(zip(filtered_detection_result.values(), last_detection_result.values()))
-                i = 5
-                oscillation = True
-                while i < 14:
-                    if abs(detection_list[i][0] - detection_list[i][1]) > 0.01:
-                        oscillation = False
-                        break
-                    i += 1
+            now = time.monotonic()
+            instrumentation.record('tick_lateness', now - next_tick)
+            next_tick += period
+            if next_tick < now:
+                # Missed ticks are skipped instead of being sent in a burst.
+                next_tick = now + period
 
-                if oscillation:
-                    self.__change_rot_mtx(filtered_detection_result, last_detection_result)
+            if prediction is None:
+                continue
 
-        
-        return detection_result, filtered_detection_result
+            with instrumentation.measure('predict'):
+                detection_result = stamp_frame_message(
+                    frame_message(self.__target_names,
+                                  [predicted_detection_result(state, now, self.__prediction_lead)
+                                   for state in prediction.states],
+                                  self.__multi_target),
+                    prediction.sequence, prediction.capture_timestamp, prediction.processed_timestamp)
 
-    def __publish_coordinates(self, data, filtered_data):
-        if self.__data_queue.full():
-            self.__data_queue.get()
-
-        self.__data_queue.put(data)
-
-        #if self.__filtered_data_queue.full():
-        #    self.__filtered_data_queue.get()
-
-        #self.__filtered_data_queue.put(filtered_data)
-
-    def __show_video_result(self, frame, detection_result):
-        win_name = "Tracking"
-        cv2.namedWindow(win_name, cv2.WND_PROP_FULLSCREEN)
-        cv2.setWindowProperty(
-            win_name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
-
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 0.6
-        font_color = (0, 255, 0)
-
-        cv2.putText(frame, 'timestamp: {}'.format(detection_result['timestamp']), (0, 20),
-                    font, font_scale, font_color, 2, cv2.LINE_AA)
-        cv2.putText(frame, 'success: {}'.format(detection_result['success']), (0, 40),
-                    font, font_scale, font_color, 2, cv2.LINE_AA)
-
-        if detection_result['success'] == 1:
-            cv2.putText(frame, 'translation_x: {:.2f}'.format(detection_result['translation_x']), (0, 60),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)     
-            cv2.putText(frame, 'translation_y: {:.2f}'.format(detection_result['translation_y']), (0, 80),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'translation_z: {:.2f}'.format(detection_result['translation_z']), (0, 100),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_right_x: {:.2f}'.format(detection_result['rotation_right_x']), (0, 120),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_right_y: {:.2f}'.format(detection_result['rotation_right_y']), (0, 140),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_right_z: {:.2f}'.format(detection_result['rotation_right_z']), (0, 160),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_up_x: {:.2f}'.format(detection_result['rotation_up_x']), (0, 180),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_up_y: {:.2f}'.format(detection_result['rotation_up_y']), (0, 200),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_up_z: {:.2f}'.format(detection_result['rotation_up_z']), (0, 220),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_forward_x: {:.2f}'.format(detection_result['rotation_forward_x']), (0, 240),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_forward_y: {:.2f}'.format(detection_result['rotation_forward_y']), (0, 260),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-            cv2.putText(frame, 'rotation_forward_z: {:.2f}'.format(detection_result['rotation_forward_z']), (0, 280),
-                        font, font_scale, font_color, 2, cv2.LINE_AA)
-
-        cv2.putText(frame, "Q - Quit ", (0, 305), font,
-                    font_scale, font_color, 2, cv2.LINE_AA)
-
-        cv2.imshow(win_name, frame)
-
-    def __change_rot_mtx(self, filtered_detection_result, last_detection_result):
-        filtered_detection_result['rotation_right_x'] = last_detection_result['rotation_right_x']
-        filtered_detection_result['rotation_right_y'] = last_detection_result['rotation_right_y']
-        filtered_detection_result['rotation_right_z'] = last_detection_result['rotation_right_z']
-        filtered_detection_result['rotation_up_x'] = last_detection_result['rotation_up_x']
-        filtered_detection_result['rotation_up_y'] = last_detection_result['rotation_up_y']
-        filtered_detection_result['rotation_up_z'] = last_detection_result['rotation_up_z']
-        filtered_detection_result['rotation_forward_x'] = last_detection_result['rotation_forward_x']
-        filtered_detection_result['rotation_forward_y'] = last_detection_result['rotation_forward_y']
-        filtered_detection_result['rotation_forward_z'] = last_detection_result['rotation_forward_z']
+            with instrumentation.measure('serialize'):
+                # Both formats carry the sequence of the frame the prediction comes from, it
+                # repeats when no newer frame arrived between two ticks.
+                data = serialize(detection_result, prediction.sequence, self.__wire_format)
 
-class DataPublishClientUDP:
+            self.__send(sock, data, prediction.capture_timestamp)
 
-    def __init__(self, server_ip, server_port, queue, filtered_queue):
-        self.server_ip = server_ip
-        self.__server_port = server_port
-        self.__queue = queue
-        self.__filtered_queue = filtered_queue
+            instrumentation.dump_periodically()
 
-    def listen(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def __send(self, sock, data, capture_timestamp):
+        instrumentation = self.__instrumentation
+        with instrumentation.measure('send'):
+            sent_timestamp = time.time()
+            sock.sendto(stamp_sent(data, self.__wire_format, sent_timestamp), (self.server_ip, self.__server_port))
 
-        while True:
-            data = self.__queue.get()
-            sock.sendto(data.encode(), (self.server_ip, self.__server_port))
-            #data = self.__filtered_queue.get()
-            #sock.sendto(data.encode(), (self.server_ip, self.__server_port))
+        instrumentation.record('capture_to_sent', sent_timestamp - capture_timestamp)
 
 
 class TrackingCofig:
 
     def __init__(self, device_number, device_parameters_dir, show_video,
-                 server_ip, server_port, marker_detection_settings, translation_offset):
+                 server_ip, server_port, marker_detection_settings, translation_offset,
+                 roi_detection=True, detection_workers=1, max_frames_in_flight=4, share_frames=False,
+                 wire_format=JSON_FORMAT, prediction_lead=0.0, output_rate=0, instrumentation=True,
+                 show_instrumentation=False, preview_rate=15, detection_scale=1.0, cube_board_pose=True,
+                 capture_resolution=(1280, 720), capture_fourcc="", capture_fps=0):
         self.device_number = device_number
         self.device_parameters_dir = device_parameters_dir
         self.show_video = show_video
@@ -386,6 +581,30 @@ class TrackingCofig:
         self.server_port = server_port
         self.marker_detection_settings = marker_detection_settings
         self.translation_offset = translation_offset
+        self.roi_detection = roi_detection
+        self.detection_workers = detection_workers
+        self.max_frames_in_flight = max_frames_in_flight
+        self.share_frames = share_frames
+        self.wire_format = wire_format
+        # Seconds ahead of now the published poses are extrapolated to.
+        self.prediction_lead = prediction_lead
+        # Poses per second published by the output clock, 0 publishes once per processed frame.
+        self.output_rate = output_rate
+        # Per stage latency histograms, dumped to assets/instrumentation.
+        self.instrumentation = instrumentation
+        self.show_instrumentation = show_instrumentation
+        # Frames per second of the video preview, drawn by its own process.
+        self.preview_rate = preview_rate
+        # Scale of the frame markers are searched on, 0 adapts it to the size of the markers.
+        self.detection_scale = detection_scale
+        # Cubes are posed from every visible face at once, instead of from their nearest face.
+        self.cube_board_pose = cube_board_pose
+        # Width and height requested from the camera.
+        self.capture_resolution = capture_resolution
+        # Capture format and frame rate, measured by capture_mode_profiler, empty and 0 keep the
+        # driver defaults.
+        self.capture_fourcc = capture_fourcc
+        self.capture_fps = capture_fps
 
     @classmethod
     def persisted(cls):
@@ -402,7 +621,22 @@ class TrackingCofig:
                            tracking_config_data['server_ip'],
                            tracking_config_data['server_port'],
                            tracking_config_data['marker_detection_settings'],
-                           tracking_config_data['translation_offset'])
+                           tracking_config_data['translation_offset'],
+                           tracking_config_data.get('roi_detection', True),
+                           tracking_config_data.get('detection_workers', 1),
+                           tracking_config_data.get('max_frames_in_flight', 4),
+                           tracking_config_data.get('share_frames', False),
+                           tracking_config_data.get('wire_format', JSON_FORMAT),
+                           tracking_config_data.get('prediction_lead', 0.0),
+                           tracking_config_data.get('output_rate', 0),
+                           tracking_config_data.get('instrumentation', True),
+                           tracking_config_data.get('show_instrumentation', False),
+                           tracking_config_data.get('preview_rate', 15),
+                           tracking_config_data.get('detection_scale', 1.0),
+                           tracking_config_data.get('cube_board_pose', True),
+                           tracking_config_data.get('capture_resolution', (1280, 720)),
+                           tracking_config_data.get('capture_fourcc', ""),
+                           tracking_config_data.get('capture_fps', 0))
         except FileNotFoundError:
             return cls(0, "", True, "", "", None, np.zeros(shape=(4, 4)))
 
@@ -416,81 +650,145 @@ class TrackingCofig:
                 'server_ip': self.server_ip,
                 'server_port': self.server_port,
                 'marker_detection_settings': self.marker_detection_settings,
-                'translation_offset': self.translation_offset}, output, pickle.HIGHEST_PROTOCOL)
-
-def rotation_matrix_to_euler(R):
-    
-    sy = math.sqrt(R[0,0] * R[0,0] +  R[1,0] * R[1,0])
-    
-    singular = sy < 1e-6
-
-    if  not singular :
-        x = math.atan2(R[2,1] , R[2,2])
-        y = math.atan2(-R[2,0], sy)
-        z = math.atan2(R[1,0], R[0,0])
-    else :
-        x = math.atan2(-R[1,2], R[1,1])
-        y = math.atan2(-R[2,0], sy)
-        z = 0
-
-    return np.array([x, y, z])
-
-def euler_to_rotation_matrix(theta):
-    
-    R_x = np.array([[1,         0,                  0                   ],
-                    [0,         math.cos(theta[0]), -math.sin(theta[0]) ],
-                    [0,         math.sin(theta[0]), math.cos(theta[0])  ]])
-        
-    R_y = np.array([[math.cos(theta[1]),    0,      math.sin(theta[1])  ],
-                    [0,                     1,      0                   ],
-                    [-math.sin(theta[1]),   0,      math.cos(theta[1])  ]])
-                               
-    R_z = np.array([[math.cos(theta[2]),    -math.sin(theta[2]),    0],
-                    [math.sin(theta[2]),    math.cos(theta[2]),     0],
-                    [0,                     0,                      1]])
-                    
-    R = np.dot(R_z, np.dot(R_y, R_x ))
-
-    return R
-
-def create_kalman_filter(num_state, num_measurements, time):
-    kalman_filter = cv2.KalmanFilter(num_state, num_measurements, type=cv2.CV_64FC1)
-
-    kalman_filter.processNoiseCov = np.eye(num_state)*1e-5
-    kalman_filter.measurementNoiseCov = np.eye(num_measurements)*1e-4
-    kalman_filter.errorCovPost = np.eye(num_state)
-
-    kalman_filter.transitionMatrix = np.eye(num_state)
-    kalman_filter.transitionMatrix[0, 3] = time
-    kalman_filter.transitionMatrix[1, 4] = time
-    kalman_filter.transitionMatrix[2, 5] = time
-    kalman_filter.transitionMatrix[3, 6] = time
-    kalman_filter.transitionMatrix[4, 7] = time
-    kalman_filter.transitionMatrix[5, 8] = time
-    kalman_filter.transitionMatrix[0, 6] = 0.5 * time ** 2
-    kalman_filter.transitionMatrix[1, 7] = 0.5 * time ** 2
-    kalman_filter.transitionMatrix[2, 8] = 0.5 * time ** 2
-
-
-    kalman_filter.measurementMatrix = np.zeros((3, 9))
-    kalman_filter.measurementMatrix[0, 0] = 1
-    kalman_filter.measurementMatrix[1, 1] = 1
-    kalman_filter.measurementMatrix[2, 2] = 1
-    return kalman_filter
-
-def create_measurement_matrix(measurement):
-    measurements = np.zeros(3)
-    measurements[0] = measurement.get('translation_x')
-    measurements[1] = measurement.get('translation_y')
-    measurements[2] = measurement.get('translation_z')
-        
-    return measurements
-
-def update_detection_result(filter, measurements, detection_result):
-    filter.predict()
-    filter.correct(measurements)
-    
-    estimated_position = filter.statePost
-    detection_result['translation_x'] = float(estimated_position[0])
-    detection_result['translation_y'] = float(estimated_position[1])
-    detection_result['translation_z'] = float(estimated_position[2])
\ No newline at end of file
+                'translation_offset': self.translation_offset,
+                'roi_detection': self.roi_detection,
+                'detection_workers': self.detection_workers,
+                'max_frames_in_flight': self.max_frames_in_flight,
+                'share_frames': self.share_frames,
+                'wire_format': self.wire_format,
+                'prediction_lead': self.prediction_lead,
+                'output_rate': self.output_rate,
+                'instrumentation': self.instrumentation,
+                'show_instrumentation': self.show_instrumentation,
+                'preview_rate': self.preview_rate,
+                'detection_scale': self.detection_scale,
+                'cube_board_pose': self.cube_board_pose,
+                'capture_resolution': self.capture_resolution,
+                'capture_fourcc': self.capture_fourcc,
+                'capture_fps': self.capture_fps}, output, pickle.HIGHEST_PROTOCOL)
+
+def set_pose_fields(detection_result, rot_mtx, tvec):
+    detection_result['translation_x'] = float(tvec[0])
+    detection_result['translation_y'] = float(tvec[1])
+    detection_result['translation_z'] = float(tvec[2])
+    detection_result['rotation_right_x'] = rot_mtx.item(0, 0)
+    detection_result['rotation_right_y'] = rot_mtx.item(1, 0)
+    detection_result['rotation_right_z'] = rot_mtx.item(2, 0)
+    detection_result['rotation_up_x'] = rot_mtx.item(0, 1)
+    detection_result['rotation_up_y'] = rot_mtx.item(1, 1)
+    detection_result['rotation_up_z'] = rot_mtx.item(2, 1)
+    detection_result['rotation_forward_x'] = rot_mtx.item(0, 2)
+    detection_result['rotation_forward_y'] = rot_mtx.item(1, 2)
+    detection_result['rotation_forward_z'] = rot_mtx.item(2, 2)
+
+
+def frame_message(target_names, detection_results, multi_target):
+    # Single target modes keep publishing the flat message.
+    if not multi_target:
+        return detection_results[0]
+
+    targets = []
+    for name, detection_result in zip(target_names, detection_results):
+        target = {'name': name}
+        target.update((key, value) for key, value in detection_result.items()
+                      if key != 'timestamp')
+        targets.append(target)
+
+    return {
+        'timestamp': detection_results[0]['timestamp'] if len(detection_results) > 0 else time.time(),
+        'success': any(target['success'] for target in targets),
+        'targets': targets}
+
+
+def stamp_frame_message(message, sequence, capture_timestamp, processed_timestamp, device_timestamp=None):
+    # Wall clock times the frame was captured and processed at, sent_timestamp is added when
+    # the message is sent. The backend frame time is only known to some capture backends.
+    message['sequence'] = sequence
+    message['capture_timestamp'] = capture_timestamp
+    message['processed_timestamp'] = processed_timestamp
+    if device_timestamp is not None:
+        message['device_timestamp'] = device_timestamp
+
+    return message
+
+
+def serialize(detection_result, sequence, wire_format):
+    if wire_format == BINARY_FORMAT:
+        return encode_pose_packet(detection_result, sequence)
+
+    return json.dumps(detection_result).encode()
+
+
+def stamp_sent(data, wire_format, sent_timestamp):
+    # Serialized messages are stamped as they are, the time they are sent at is only known to the publisher.
+    if wire_format == BINARY_FORMAT:
+        return stamp_pose_packet(data, sent_timestamp)
+
+    # A JSON message is an object, the field is added before its closing brace.
+    return data[:-1] + ', "sent_timestamp": {}}}'.format(json.dumps(sent_timestamp)).encode()
+
+
+def encode_pose_prediction(prediction):
+    # Plain float64 values, targets without a state have a NaN timestamp.
+    values = [[prediction.sequence, prediction.capture_timestamp, prediction.processed_timestamp]]
+    for state in prediction.states:
+        if state is None:
+            values.append(np.full(PREDICTION_STATE_SIZE, np.nan))
+        else:
+            values.extend([[state.timestamp], state.translation_states.ravel(), state.rotation_states.ravel()])
+
+    return np.concatenate(values).astype(np.float64).tobytes()
+
+
+def decode_pose_prediction(data):
+    values = np.frombuffer(data, dtype=np.float64)
+
+    states = []
+    for offset in range(3, values.size, PREDICTION_STATE_SIZE):
+        state = values[offset:offset + PREDICTION_STATE_SIZE]
+        if np.isnan(state[0]):
+            states.append(None)
+        else:
+            states.append(PoseState(float(state[0]), state[1:10].reshape(3, 3), state[10:].reshape(4, 2)))
+
+    return PosePrediction(int(values[0]), states, float(values[1]), float(values[2]))
+
+
+def smallest_marker_side(corners):
+    points = np.reshape(np.array(corners), (-1, 4, 2))
+
+    return float(np.linalg.norm(points - np.roll(points, 1, axis=1), axis=2).min())
+
+
+def private_frame_ring_name(tracking_pid):
+    # Ring of a tracking process whose frames are only shared with its detection workers.
+    return "ar_tracking_frames_{}".format(tracking_pid)
+
+
+def put_latest(queue, data):
+    # Consumers only care about the newest data, an unread item is replaced. The unread item may
+    # still be on its way through the queue pipe, so it is waited for briefly.
+    while True:
+        try:
+            queue.put_nowait(data)
+            return
+        except Full:
+            try:
+                queue.get(timeout=0.01)
+            except Empty:
+                pass
+
+
+def predicted_detection_result(pose_state, now, prediction_lead):
+    # How long ago the target was seen does not depend on the lead, only the extrapolation does.
+    detection_result = {}
+    detection_result['timestamp'] = time.time()
+    detection_result['success'] = pose_state is not None and \
+        now - pose_state.timestamp <= MAX_PREDICTION_TIME
+
+    if detection_result['success']:
+        prediction_time = min(now + prediction_lead, pose_state.timestamp + MAX_EXTRAPOLATION_TIME)
+        tvec, rot_mtx = predict_pose(pose_state, prediction_time)
+        set_pose_fields(detection_result, rot_mtx, tvec)
+
+    return detection_result
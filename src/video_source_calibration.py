@@ -5,17 +5,43 @@ except ModuleNotFoundError:
 
 import os
 import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
 import cv2.aruco as aruco
+from calibration_registry import calibration_registry
+
+# Inner corners of the chessboard.
+CHESSBOARD_SIZE = (9, 6)
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+def find_chessboard_corners(gray):
+    # Refined corners of the chessboard, None when it is not found. Runs in the calibration
+    # process pool, so only the corners are kept, not the frames.
+    found, corners = cv2.findChessboardCorners(gray, CHESSBOARD_SIZE, None)
+    if not found:
+        return None
+
+    return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), SUBPIX_CRITERIA)
+
+
+def calibrate_camera(image_points, image_size, chessboard_square_size):
+    # Returns the RMS reprojection error, the camera matrix and the distortion coefficients.
+    columns, rows = CHESSBOARD_SIZE
+    objp = np.zeros((columns * rows, 3), np.float32)
+    objp[:, :2] = np.mgrid[0:columns, 0:rows].T.reshape(-1, 2)*float(chessboard_square_size)
+
+    ret_val, cam_mtx, dist, _, _ = cv2.calibrateCamera(
+        [objp] * len(image_points), image_points, image_size, None, None)
+
+    return ret_val, cam_mtx, dist
 
 
 class VideoSourceCalibration:
 
     def __init__(self, video_source_dir, video_source, calibration_config):
-        self.__criteria = (cv2.TERM_CRITERIA_EPS +
-                           cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
-
         self.__video_source_dir = video_source_dir
         self.__video_source = video_source
         self.__calibration_config = calibration_config
@@ -38,7 +64,11 @@ class VideoSourceCalibration:
         video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
         video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
 
-        calibration_frames = []
+        # Chessboard corners of the captured frames, found while the next frames are captured.
+        pool = ProcessPoolExecutor(max(multiprocessing.cpu_count() - 1, 1))
+        pending_corners = []
+        image_points = []
+        image_size = None
         ready_to_calibrate = False
         start_calibration = False
         status_color = red
@@ -47,19 +77,22 @@ class VideoSourceCalibration:
 
             _, frame = video_capture.read()
 
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            for future in [future for future in pending_corners if future.done()]:
+                pending_corners.remove(future)
+                corners = future.result()
+                if corners is not None:
+                    image_points.append(corners)
 
             cv2.putText(frame, "calibration image count: {}. Minimum 50".format(
-                len(calibration_frames)), (0, 20), font, font_scale, status_color, 2, cv2.LINE_AA)
+                len(image_points)), (0, 20), font, font_scale, status_color, 2, cv2.LINE_AA)
 
             cv2.putText(frame, "ENTER - Capture frame for calibration", (0, 40),
                         font, font_scale, green, 2, cv2.LINE_AA)
 
             if option == 13:
-                found, _ = cv2.findChessboardCorners(gray, (9, 6), None)
-
-                if found:
-                    calibration_frames.append(gray)
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                image_size = gray.shape[::-1]
+                pending_corners.append(pool.submit(find_chessboard_corners, gray))
 
             if ready_to_calibrate:
                 cv2.putText(frame, "C - Start Calibration", (0, 60),
@@ -76,8 +109,14 @@ class VideoSourceCalibration:
             cv2.imshow(win_name, frame)
 
             if start_calibration:
-                cv2.waitKey(2000)
-                self.__run(calibration_frames)
+                cv2.waitKey(100)
+                for future in pending_corners:
+                    corners = future.result()
+                    if corners is not None:
+                        image_points.append(corners)
+                pool.shutdown()
+
+                self.__run(image_points, image_size)
                 cv2.imshow(win_name, frame)
                 cv2.waitKey(1000)
                 video_capture.release()
@@ -85,47 +124,24 @@ class VideoSourceCalibration:
                 break
 
             if option == ord('q'):
+                pool.shutdown(wait=False)
                 video_capture.release()
                 cv2.destroyAllWindows()
                 break
 
-            if len(calibration_frames) >= 50:
+            if len(image_points) >= 50:
                 ready_to_calibrate = True
                 status_color = green
 
     def delete_calibration(self):
-        if os.path.isfile('{}/cam_mtx.npy'.format(self.__video_source_dir)):
-            os.remove('{}/cam_mtx.npy'.format(self.__video_source_dir))
-
-        if os.path.isfile('{}/dist.npy'.format(self.__video_source_dir)):
-            os.remove('{}/dist.npy'.format(self.__video_source_dir))
-
-    def __run(self, calibration_frames):
-        objp = np.zeros((9*6, 3), np.float32)
-        objp[:, :2] = np.mgrid[0:9, 0:6].T.reshape(-1, 2)*float(
-            self.__calibration_config.chessboard_square_size)
+        calibration_registry.delete(self.__video_source_dir)
 
-        objpoints = []
-        imgpoints = []
-
-        img_size = calibration_frames[0].shape[::-1]
-        for frame in calibration_frames:
-            found, corners = cv2.findChessboardCorners(frame, (9, 6), None)
-            if found:
-                objpoints.append(objp)
-                corners2 = cv2.cornerSubPix(
-                    frame, corners, (11, 11), (-1, -1), self.__criteria)
-                imgpoints.append(corners2)
-
-        ret_val, cam_mtx, dist, _, _ = cv2.calibrateCamera(
-            objpoints, imgpoints, img_size, None, None)
+    def __run(self, image_points, image_size):
+        ret_val, cam_mtx, dist = calibrate_camera(
+            image_points, image_size, self.__calibration_config.chessboard_square_size)
 
         if ret_val:
-            if not os.path.exists(self.__video_source_dir):
-                os.makedirs(self.__video_source_dir)
-
-            np.save('{}/cam_mtx.npy'.format(self.__video_source_dir), cam_mtx)
-            np.save('{}/dist.npy'.format(self.__video_source_dir), dist)
+            calibration_registry.save(self.__video_source_dir, cam_mtx, dist, image_size)
 
 
 class VideoSourceCalibrationConfig: